@@ -5,35 +5,110 @@ Created on Wed Apr 16 14:42:56 2025
 @author: KyleGraham
 """
 import numpy as np
-from scipy import interpolate
+from .SpectralDeviation import resample
 
-def conv2Irrad(scanX, scanY, tFunc):
+def conv2Irrad(scanX, scanY, tFunc, waves = None):
     '''
-    conv2Irrad will convert an array of raw spectral data to spectral irradiance
-    scanX should be wavelength values from the user's scan
-    scanY should be voltage values from the user's scan
-    tFunc is a transfer function for the measurement instrument in units of W/cm^2/nm/V
-    '''    
-    minX = np.ceil(max(min(scanX), min(tFunc['tWaves'])))    # Finds the min wavelength of each input, chooses the largest one, then rounds to the nearest integer.
-    maxX = np.floor(min(max(scanX), max(tFunc['tWaves'])))   # Finds the max wavelength of each input, chooses the smallest one, then rounds to the nearest integer.
-    print('\nInterpolating over range: ' + str(minX) + ' to ' + str(maxX) + '.')
-    
-    Xs = np.arange(minX,maxX + 1,1);
-    
-    # interpolate the test data over the wave range
-    interper = interpolate.interp1d(scanX, scanY)
-    interpTFunc = interper(Xs)
-    
-    k_min = tFunc[tFunc['tWaves'] == minX].index.values[0]
-    k_max = tFunc[tFunc['tWaves'] == maxX].index.values[0]
-    transfer = tFunc['tdata'].iloc[k_min:k_max + 1]
-    transfer = transfer.reset_index()
+    conv2Irrad will convert raw spectral data to spectral irradiance
+    scanX should be wavelength values from the user's scan, in ascending order
+    scanY should be voltage values from the user's scan, or an (N, len(scanX)) stack of scans taken at the same wavelengths
+    tFunc is a transfer function for the measurement instrument in units of W/cm^2/nm/V, given as {'tWaves': ..., 'tdata': ...}
+    (e.g. from ReferenceData.transferFunction, or a DataFrame with those columns). Its wavelengths may be non-integer and non-uniform.
+    By default the result is given at the transfer function's own wavelengths inside the scan range; pass waves to choose the output wavelengths instead.
+    '''
+    scanX = np.asarray(scanX, dtype = np.float64)
+    tWaves = np.asarray(tFunc['tWaves'], dtype = np.float64)
+    tData = np.asarray(tFunc['tdata'], dtype = np.float64)
+    minX = max(scanX.min(), tWaves.min())    # Finds the min wavelength of each input and chooses the largest one.
+    maxX = min(scanX.max(), tWaves.max())    # Finds the max wavelength of each input and chooses the smallest one.
+    
+    if waves is None:
+        # Use the transfer function samples that lie inside the scan.
+        lowIndex, highIndex = np.searchsorted(tWaves, minX, side = 'left'), np.searchsorted(tWaves, maxX, side = 'right')
+        Xs = tWaves[lowIndex:highIndex]
+        transfer = tData[lowIndex:highIndex]
+    else:
+        Xs = np.asarray(waves, dtype = np.float64)
+        Xs = Xs[(Xs >= minX) & (Xs <= maxX)]
+        transfer = np.interp(Xs, tWaves, tData)
+    print('\nInterpolating over range: ' + str(Xs[0]) + ' to ' + str(Xs[-1]) + '.')
+    
+    # interpolate the test data (every scan in the stack at once) onto the output wavelengths
+    converted = resample(scanX, scanY, Xs) * transfer
     print('\nUnits in W/cm^2')
-    converted = interpTFunc * transfer['tdata']
     
     theDictionary = {
         'irradWaves': Xs,
         'irrad': converted
         }
     
-    return theDictionary
\ No newline at end of file
+    return theDictionary
+
+def stitchSpectra(siWaves, siIrrad, igaWaves, igaIrrad, overlap = (900, 1100), scale = False, window = 5, crosspoint = None):
+    '''
+    stitchSpectra joins Si and InGaAs spectral irradiance into one spectrum at the crosspoint that minimizes the discontinuity between them.
+    Every Si wavelength in the overlap region is a candidate crosspoint, and all candidates are scored in one vectorized pass:
+    the score is the RMS mismatch between the detectors over +/- window nm around the candidate, as a % of the Si irradiance there.
+    With scale = True the InGaAs data is also multiplied by the least-squares scale factor for that window; otherwise the factor is 1.
+    Pass crosspoint to force the join at (the nearest candidate to) a given wavelength and still get the mismatch report.
+    The combined spectrum uses Si up to and including the crosspoint and the (scaled) InGaAs data above it.
+    '''
+    siWaves = np.asarray(siWaves, dtype = np.float64)
+    siIrrad = np.asarray(siIrrad, dtype = np.float64)
+    igaWaves = np.asarray(igaWaves, dtype = np.float64)
+    igaIrrad = np.asarray(igaIrrad, dtype = np.float64)
+    
+    low = max(overlap[0], siWaves.min(), igaWaves.min())
+    high = min(overlap[1], siWaves.max(), igaWaves.max())
+    candidates = siWaves[(siWaves >= low) & (siWaves <= high)]
+    if len(candidates) == 0:
+        raise ValueError('The Si and InGaAs data do not overlap between ' + str(overlap[0]) + ' and ' + str(overlap[1]) + ' nm.')
+    si = np.interp(candidates, siWaves, siIrrad)
+    iga = np.interp(candidates, igaWaves, igaIrrad)
+    
+    # Windowed sums around every candidate, from running sums, so each score is O(1).
+    lowIndex = np.searchsorted(candidates, candidates - window, side = 'left')
+    highIndex = np.searchsorted(candidates, candidates + window, side = 'right')
+    def windowSum(values):
+        running = np.concatenate(([0.0], np.cumsum(values)))
+        return running[highIndex] - running[lowIndex]
+    count = highIndex - lowIndex
+    sumSi = windowSum(si)
+    sumSiSi = windowSum(si * si)
+    sumSiIga = windowSum(si * iga)
+    sumIgaIga = windowSum(iga * iga)
+    
+    if scale:
+        factors = np.divide(sumSiIga, sumIgaIga, out = np.ones_like(sumSiIga), where = sumIgaIga > 0)
+    else:
+        factors = np.ones_like(sumSiIga)
+    
+    # Residual sum of squares of (si - factor * iga) over each window, expanded so it only needs the windowed sums.
+    squares = np.clip(sumSiSi - 2 * factors * sumSiIga + factors ** 2 * sumIgaIga, 0, None)
+    scores = np.sqrt(squares / count) / (sumSi / count) * 100
+    
+    if crosspoint is None:
+        best = np.nanargmin(scores)
+    else:
+        best = np.argmin(np.abs(candidates - crosspoint))
+    bestWave = candidates[best]
+    factor = factors[best]
+    step = abs(factor * iga[best] - si[best])
+    
+    # combined wavelength and irradiance data
+    keepSi = siWaves <= bestWave
+    keepIga = igaWaves > bestWave
+    
+    theDictionary = {
+        'irradWaves': np.concatenate((siWaves[keepSi], igaWaves[keepIga])),
+        'irrad': np.concatenate((siIrrad[keepSi], factor * igaIrrad[keepIga])),
+        'crosspoint': bestWave,
+        'scale': factor,
+        'step': step,
+        'stepPercent': step / si[best] * 100,
+        'residual': scores[best],
+        'candidates': candidates,
+        'scores': scores
+        }
+    
+    return theDictionary
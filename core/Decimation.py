@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Decimation of long time series for plotting. A plot only has so many pixels, so the report plots draw a fixed number of points
+picked to keep the shape and the extremes of the trace. All statistics are still calculated on the full data.
+"""
+import numpy as np
+
+PLOT_POINTS = 2000      # default point budget for one plotted series
+
+
+def minMaxIndex(y, points = PLOT_POINTS):
+    '''
+    minMaxIndex splits y into points / 2 equal buckets and keeps the lowest and highest sample of each, in time order.
+    Every excursion survives, so the global min and max are always kept, and so are the first and last samples so the trace spans
+    its full time range. A bucket holding only NaNs keeps its first sample. Returns the sorted indices of the kept samples.
+    '''
+    y = np.asarray(y, dtype = np.float64)
+    count = len(y)
+    if count <= points:
+        return np.arange(count)
+
+    size = int(np.ceil(count / max(points // 2, 1)))
+    buckets = int(np.ceil(count / size))
+    padded = np.full(buckets * size, np.nan)
+    padded[:count] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    # nanargmin/nanargmax raise on an all-NaN row, so such buckets are zeroed and fall back to their first index.
+    padded[np.isnan(padded).all(axis = 1)] = 0.0
+    lows = offsets + np.nanargmin(padded, axis = 1)
+    highs = offsets + np.nanargmax(padded, axis = 1)
+    return np.unique(np.concatenate((lows, highs, [0, count - 1])))
+
+
+def lttbIndex(x, y, points = PLOT_POINTS):
+    '''
+    lttbIndex picks `points` samples with the Largest-Triangle-Three-Buckets algorithm, which keeps the visual shape of a trace
+    better than min/max bucketing for smooth data. The first, last, lowest and highest samples are always kept as well.
+    Each bucket is scored in one vectorized step; only the walk from bucket to bucket is a loop, so the cost depends on the budget, not on len(y).
+    Returns the sorted indices of the kept samples.
+    '''
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    count = len(y)
+    if count <= points or points < 3:
+        return np.arange(count)
+
+    # Interior buckets between the fixed first and last points.
+    edges = np.linspace(1, count - 1, points - 1).astype(int)
+    kept = np.empty(points, dtype = int)
+    kept[0] = 0
+    kept[-1] = count - 1
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # The next bucket is represented by its average point (the last point for the final bucket).
+        if bucket + 2 < len(edges):
+            nextX = x[stop:edges[bucket + 2]].mean()
+            nextY = y[stop:edges[bucket + 2]].mean()
+        else:
+            nextX, nextY = x[-1], y[-1]
+        previous = kept[bucket]
+        area = np.abs((x[previous] - nextX) * (y[start:stop] - y[previous]) - (x[previous] - x[start:stop]) * (nextY - y[previous]))
+        kept[bucket + 1] = start + int(np.argmax(area))
+
+    return np.unique(np.concatenate((kept, [np.argmin(y), np.argmax(y)])))
+
+
+def decimate(x, y, points = PLOT_POINTS, method = 'minmax'):
+    '''
+    decimate returns (x, y) reduced to about `points` samples for plotting, using 'minmax' bucketing (default) or 'lttb'.
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if method == 'minmax':
+        index = minMaxIndex(y, points)
+    elif method == 'lttb':
+        index = lttbIndex(x, y, points)
+    else:
+        raise ValueError("method must be 'minmax' or 'lttb', not " + repr(method))
+    return x[index], y[index]
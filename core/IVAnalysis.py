@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+IV-curve parameter extraction (Isc, Voc, Pmax, Vmp, Imp, FF) for many .ivdat sweeps at once.
+Curves of different lengths are stacked into NaN-padded (curves, points) arrays so every parameter is one array operation over the whole archive.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.special import wrightomega
+from .SciImports import sciFileParse, fileContents
+
+BOLTZMANN = 1.380649e-23            # J/K
+ELEMENTARY_CHARGE = 1.602176634e-19 # C
+
+# One row per curve from diodeFit. n is the ideality factor per cell; rmse is in A and nrmse in % of Isc.
+DIODE_DTYPE = np.dtype([('IL', 'f8'), ('I0', 'f8'), ('Rs', 'f8'), ('Rsh', 'f8'), ('n', 'f8'),
+                        ('rmse', 'f8'), ('nrmse', 'f8'), ('success', '?')])
+
+# Bounds of the fitted parameter rows (IL, ln I0, Rs, ln Rsh, a), and the retry rule for poor fits (nrmse in % of Isc).
+DIODE_LOWER = np.array([0, -80, 1e-6, -7, 1e-4])
+DIODE_UPPER = np.array([np.inf, 5, np.inf, 21, np.inf])
+RETRY_NRMSE = 0.5
+RETRY_IDEALITY = 1.5
+
+# Footer field holding the instrument's value of each extracted parameter (same units).
+FOOTER_FIELDS = {
+    'Voc': 'OpenCircuitVoltage [V]',
+    'Isc': 'ShortCircuitCurrent [A]',
+    'Pmax': 'MaxPower [W]',
+    'FF': 'FillFactor [%]',
+}
+
+
+def ivStack(curves):
+    '''
+    ivStack pads a list of 1-D arrays (one per curve, any lengths) with NaN into a single (curves, points) float64 array.
+    '''
+    curves = [np.asarray(curve, dtype = np.float64).reshape(-1) for curve in curves]
+    stack = np.full((len(curves), max((len(curve) for curve in curves), default = 0)), np.nan)
+    for row, curve in enumerate(curves):
+        stack[row, :len(curve)] = curve
+    return stack
+
+
+def _curveStack(curves):
+    '''
+    Returns curves as a (curves, points) float64 array with at least two columns (NaN padded). A 1-D array or a list of numbers is
+    a single curve; a list of arrays is stacked with ivStack.
+    '''
+    if isinstance(curves, np.ndarray) and curves.ndim == 2:
+        stack = curves.astype(np.float64)
+    elif (isinstance(curves, np.ndarray) and curves.ndim == 1) or (len(curves) and all(np.isscalar(value) for value in curves)):
+        stack = np.asarray(curves, dtype = np.float64).reshape(1, -1)
+    else:
+        stack = ivStack(curves)
+    if stack.shape[1] < 2:
+        stack = np.hstack((stack, np.full((len(stack), 2 - stack.shape[1]), np.nan)))
+    return stack
+
+
+def _crossing(x, y):
+    '''
+    For each row, linearly interpolates y where x first crosses zero going up. x must be sorted along each row (NaN last),
+    as the voltage of an oriented sweep is. Rows that never reach zero are NaN. A row that touches zero exactly returns y at that point.
+    '''
+    low, high = x[:, :-1], x[:, 1:]
+    crosses = (low <= 0) & (high >= 0) & (high > low)
+    exact = x == 0
+    rows = np.arange(len(x))
+
+    index = np.argmax(crosses, axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        fraction = -low[rows, index] / (high[rows, index] - low[rows, index])
+    value = y[rows, index] + fraction * (y[rows, index + 1] - y[rows, index])
+    value = np.where(crosses.any(axis = 1), value, np.nan)
+
+    # Prefer an exact zero when the sweep has one.
+    exactIndex = np.argmax(exact, axis = 1)
+    return np.where(exact.any(axis = 1), y[rows, exactIndex], value)
+
+
+def _lastFall(x, y):
+    '''
+    For each row, linearly interpolates x where y last falls through zero, going along x (sorted, NaN last). Used for Voc: taking
+    the last fall of the current, rather than the first, keeps a stray negative reading near short circuit from being taken as Voc.
+    Rows where y never falls to zero are NaN.
+    '''
+    low, high = y[:, :-1], y[:, 1:]
+    falls = (low >= 0) & (high <= 0) & (high < low)
+    rows = np.arange(len(y))
+    index = falls.shape[1] - 1 - np.argmax(falls[:, ::-1], axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        fraction = low[rows, index] / (low[rows, index] - high[rows, index])
+    value = x[rows, index] + fraction * (x[rows, index + 1] - x[rows, index])
+    return np.where(falls.any(axis = 1), value, np.nan)
+
+
+def _ivOriented(voltage, current):
+    '''
+    Stacks the curves (see _curveStack), sorts every sweep by voltage (NaN padding stays at the end)
+    and flips the sign of curves recorded with negative photocurrent, judged from the reading closest to V = 0.
+    '''
+    voltage = _curveStack(voltage)
+    current = _curveStack(current)
+    rows = np.arange(len(voltage))
+
+    order = np.argsort(voltage, axis = 1)
+    voltage = np.take_along_axis(voltage, order, axis = 1)
+    current = np.take_along_axis(current, order, axis = 1)
+
+    nearZero = np.nanargmin(np.where(np.isnan(voltage), np.inf, np.abs(voltage)), axis = 1)
+    current = current * np.where(current[rows, nearZero] < 0, -1.0, 1.0)[:, None]
+    return voltage, current
+
+
+def ivParameters(voltage, current):
+    '''
+    ivParameters extracts the IV parameters of many curves at once.
+    voltage and current are lists of per-curve arrays, NaN-padded (curves, points) arrays, or 1-D arrays of a single curve;
+    sweeps may run in either direction.
+    The photocurrent may be recorded as negative (source meter convention) or positive; each curve is oriented so that Isc > 0.
+        Isc  = current interpolated at V = 0
+        Voc  = voltage interpolated where the current last falls through I = 0
+        Pmax = the largest measured V * I in the power-generating quadrant, at Vmp and Imp
+        FF   = Pmax / (Isc * Voc) * 100
+    Parameters a sweep does not reach (e.g. no V = 0 crossing, or fewer than two points) are NaN.
+    Returns a dictionary of (curves,) arrays keyed 'Isc', 'Voc', 'Pmax', 'Vmp', 'Imp' and 'FF'.
+    '''
+    voltage, current = _ivOriented(voltage, current)
+    rows = np.arange(len(voltage))
+
+    Isc = _crossing(voltage, current)
+    Voc = _lastFall(voltage, current)
+
+    power = voltage * current
+    generating = (voltage >= 0) & (current >= 0)
+    power = np.where(generating, power, -np.inf)
+    best = np.argmax(power, axis = 1)
+    found = generating.any(axis = 1)
+    Pmax = np.where(found, power[rows, best], np.nan)
+    Vmp = np.where(found, voltage[rows, best], np.nan)
+    Imp = np.where(found, current[rows, best], np.nan)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        FF = Pmax / (Isc * Voc) * 100
+
+    theDictionary = {
+        'Isc': Isc,
+        'Voc': Voc,
+        'Pmax': Pmax,
+        'Vmp': Vmp,
+        'Imp': Imp,
+        'FF': FF,
+    }
+    return theDictionary
+
+
+def diodeCurrent(voltage, IL, I0, Rs, Rsh, a):
+    '''
+    diodeCurrent evaluates the single-diode model I = IL - I0 * (exp((V + I * Rs) / a) - 1) - (V + I * Rs) / Rsh explicitly
+    through the Lambert W function, written with the Wright omega function (W(exp(z))) so large exponents cannot overflow.
+    a is the modified ideality factor n * cells * kT / q in volts. The parameters broadcast against voltage, so a (curves, 1)
+    column of parameters evaluates a whole (curves, points) stack at once. Rs must be > 0.
+    '''
+    total = Rs + Rsh
+    z = np.log(Rs * I0 * Rsh / (a * total)) + Rsh * (Rs * (IL + I0) + voltage) / (a * total)
+    return (Rsh * (IL + I0) - voltage) / total - a / Rs * wrightomega(z)
+
+
+def _maskedSlope(x, y, mask):
+    '''
+    Least-squares slope of y against x along each row, using only the masked points. Rows with fewer than two points are NaN.
+    '''
+    count = mask.sum(axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        meanX = np.where(mask, x, 0).sum(axis = 1) / count
+        meanY = np.where(mask, y, 0).sum(axis = 1) / count
+        dx = np.where(mask, x - meanX[:, None], 0)
+        slope = (dx * np.where(mask, y - meanY[:, None], 0)).sum(axis = 1) / (dx ** 2).sum(axis = 1)
+    return np.where(count >= 2, slope, np.nan)
+
+
+def diodeGuess(voltage, current):
+    '''
+    diodeGuess estimates single-diode parameters for every curve at once, as starting points for diodeFit.
+        Rsh from the slope of the curve near short circuit, Rs from the slope near open circuit
+        a from Isc, Voc, Vmp and Imp with the explicit approximation a = (2 Vmp - Voc) / (Isc / (Isc - Imp) + ln(1 - Imp / Isc))
+        I0 and IL so the model passes through Isc and Voc
+    Curves are oriented as in ivParameters. Returns a dictionary of (curves,) arrays keyed 'IL', 'I0', 'Rs', 'Rsh', 'a',
+    plus 'Isc' and 'Voc'; curves without a usable Isc, Voc and maximum power point are NaN.
+    '''
+    voltage, current = _ivOriented(voltage, current)
+    params = ivParameters(voltage, current)
+    Isc, Voc, Vmp, Imp = params['Isc'], params['Voc'], params['Vmp'], params['Imp']
+    valid = np.isfinite(voltage) & np.isfinite(current)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        slopeSc = _maskedSlope(voltage, current, valid & (voltage <= 0.5 * Vmp[:, None]))
+        Rsh = np.where(slopeSc < 0, -1 / slopeSc, 1000 * Voc / Isc)
+        Rsh = np.maximum(Rsh, 10 * Voc / Isc)
+
+        a = (2 * Vmp - Voc) / (Isc / (Isc - Imp) + np.log(1 - Imp / Isc))
+        a = np.where(np.isfinite(a) & (a > 0), a, Voc / 20)
+
+        slopeOc = _maskedSlope(current, voltage, valid & (np.abs(current) <= 0.2 * Isc[:, None]))
+        Rs = np.where(np.isfinite(slopeOc), -slopeOc - a / Isc, 0.01 * Voc / Isc)
+        Rs = np.clip(Rs, 1e-4 * Voc / Isc, 0.5 * Voc / Isc)
+
+        I0 = np.maximum(Isc - Voc / Rsh, 1e-3 * Isc) * np.exp(-Voc / a)
+        IL = Isc * (1 + Rs / Rsh)
+
+    theDictionary = {
+        'IL': IL,
+        'I0': I0,
+        'Rs': Rs,
+        'Rsh': Rsh,
+        'a': a,
+        'Isc': Isc,
+        'Voc': Voc,
+    }
+    return theDictionary
+
+
+def _diodeResiduals(x, voltage, current, usable, scale):
+    '''
+    Residuals of the single-diode model for a stack of parameter rows x = (IL, ln I0, Rs, ln Rsh, a), normalized by `scale` (Isc)
+    so small and large devices weigh the same, and their Jacobian with respect to x.
+    The Jacobian comes from implicit differentiation of the model equation f(I, V) = 0: dI/dp = -(df/dp) / (df/dI).
+    Padding contributes nothing; non-finite model values count as a large misfit.
+    '''
+    IL, I0, Rs, Rsh, a = x[:, :1], np.exp(x[:, 1:2]), x[:, 2:3], np.exp(x[:, 3:4]), x[:, 4:5]
+    model = diodeCurrent(voltage, IL, I0, Rs, Rsh, a)
+    error = np.where(usable, (model - current) / scale[:, None], 0)
+    error = np.nan_to_num(error, nan = 1e3, posinf = 1e3, neginf = -1e3)
+
+    with np.errstate(over = 'ignore', invalid = 'ignore'):
+        drop = voltage + model * Rs
+        diode = I0 * np.exp(np.minimum(drop / a, 700))
+        dfdI = -(diode * Rs / a + Rs / Rsh + 1)
+        partials = np.stack((np.ones_like(model), -(diode - I0), -(diode * model / a + model / Rsh), drop / Rsh, diode * drop / a ** 2), axis = -1)
+        jacobian = -partials / dfdI[:, :, None]
+    jacobian = np.where(usable[:, :, None], jacobian / scale[:, None, None], 0)
+    return error, np.nan_to_num(jacobian, nan = 0, posinf = 0, neginf = 0)
+
+
+def _diodeSolve(x, voltage, current, usable, scale, maxIterations, tolerance):
+    '''
+    Batched Levenberg-Marquardt solver for the single-diode model. Every curve keeps its own damping and step acceptance,
+    but each iteration is one whole-stack model and Jacobian evaluation and one stacked 5 x 5 solve.
+    Curves drop out of the working set as they converge. Returns the fitted parameter rows, their normalized residuals and a converged flag per curve.
+    '''
+    x = x.copy()
+    error, jacobian = _diodeResiduals(x, voltage, current, usable, scale)
+    cost = (error ** 2).sum(axis = 1)
+    damping = np.full(len(x), 1e-3)
+    converged = np.zeros(len(x), dtype = bool)
+
+    for iteration in range(maxIterations):
+        active = np.nonzero(~converged)[0]
+        if len(active) == 0:
+            break
+        xa = x[active]
+
+        normal = np.einsum('mpi,mpj->mij', jacobian[active], jacobian[active])
+        gradient = np.einsum('mpi,mp->mi', jacobian[active], error[active])
+        diagonal = np.maximum(np.einsum('mii->mi', normal), 1e-12)
+        system = normal + (damping[active, None] * diagonal)[:, :, None] * np.eye(5)
+        delta = -np.linalg.solve(system, gradient[:, :, None])[:, :, 0]
+
+        trial = np.clip(xa + delta, DIODE_LOWER, DIODE_UPPER)
+        trialError, trialJacobian = _diodeResiduals(trial, voltage[active], current[active], usable[active], scale[active])
+        trialCost = (trialError ** 2).sum(axis = 1)
+        better = trialCost < cost[active]
+
+        accepted = active[better]
+        improvement = (cost[accepted] - trialCost[better]) / np.maximum(cost[accepted], 1e-300)
+        x[accepted] = trial[better]
+        error[accepted] = trialError[better]
+        jacobian[accepted] = trialJacobian[better]
+        cost[accepted] = trialCost[better]
+        damping[accepted] = np.maximum(damping[accepted] / 3, 1e-12)
+        damping[active[~better]] *= 4
+
+        # Converged once an accepted step barely changes the cost or the parameters, or the damping shows no step can improve it.
+        tiny = np.all(np.abs(delta[better]) <= 1e-8 * np.maximum(np.abs(xa[better]), 1e-3), axis = 1)
+        converged[accepted[(improvement < tolerance) | tiny]] = True
+        converged[active[~better & (damping[active] > 1e12)]] = True
+
+    return x, error, converged
+
+
+def _diodeFitChunk(item):
+    '''
+    Fits one chunk of curves: _diodeSolve from the diodeGuess starting points, then once more from a nominal ideality factor
+    (n = RETRY_IDEALITY) for curves left with a poor fit, keeping the better of the two.
+    '''
+    voltage, current, thermal, maxIterations, tolerance = item
+    voltage, current = _ivOriented(voltage, current)
+    guess = diodeGuess(voltage, current)
+    result = np.zeros(len(voltage), dtype = DIODE_DTYPE)
+    result[['IL', 'I0', 'Rs', 'Rsh', 'n', 'rmse', 'nrmse']] = np.nan
+
+    usable = np.isfinite(voltage) & np.isfinite(current)
+    fit = np.nonzero(np.all([np.isfinite(guess[key]) for key in ('IL', 'I0', 'Rs', 'Rsh', 'a')], axis = 0) & (usable.sum(axis = 1) >= 5))[0]
+    if len(fit) == 0:
+        return result
+    usable = usable[fit]
+    voltage = np.where(usable, voltage[fit], 0)
+    current = np.where(usable, current[fit], 0)
+    scale = guess['Isc'][fit]
+    points = usable.sum(axis = 1)
+
+    # Parameters per curve: IL, ln(I0), Rs, ln(Rsh), a. Logs keep I0 and Rsh, which span decades, well scaled.
+    start = np.column_stack((guess['IL'][fit], np.log(guess['I0'][fit]), guess['Rs'][fit], np.log(guess['Rsh'][fit]), guess['a'][fit]))
+    x, error, converged = _diodeSolve(np.clip(start, DIODE_LOWER, DIODE_UPPER), voltage, current, usable, scale, maxIterations, tolerance)
+    nrmse = 100 * np.sqrt((error ** 2).sum(axis = 1) / points)
+
+    retry = np.nonzero(nrmse > RETRY_NRMSE)[0]
+    if len(retry):
+        a = np.full(len(retry), RETRY_IDEALITY * thermal)
+        Voc = guess['Voc'][fit][retry]
+        start = start[retry]
+        start[:, 4] = a
+        start[:, 1] = np.log(np.maximum(scale[retry] - Voc / np.exp(start[:, 3]), 1e-3 * scale[retry])) - Voc / a
+        xRetry, errorRetry, convergedRetry = _diodeSolve(np.clip(start, DIODE_LOWER, DIODE_UPPER), voltage[retry], current[retry], usable[retry],
+                                                         scale[retry], maxIterations, tolerance)
+        better = (errorRetry ** 2).sum(axis = 1) < (error[retry] ** 2).sum(axis = 1)
+        x[retry[better]] = xRetry[better]
+        error[retry[better]] = errorRetry[better]
+        converged[retry[better]] = convergedRetry[better]
+
+    error *= scale[:, None]
+    rmse = np.sqrt((error ** 2).sum(axis = 1) / points)
+    result['IL'][fit] = x[:, 0]
+    result['I0'][fit] = np.exp(x[:, 1])
+    result['Rs'][fit] = x[:, 2]
+    result['Rsh'][fit] = np.exp(x[:, 3])
+    result['n'][fit] = x[:, 4] / thermal
+    result['rmse'][fit] = rmse
+    result['nrmse'][fit] = 100 * rmse / scale
+    result['success'][fit] = converged
+    return result
+
+
+def diodeFit(voltage, current, cells = 1, temperature = 25, chunkSize = 256, processes = 1, maxIterations = 1000, tolerance = 1e-10):
+    '''
+    diodeFit fits the single-diode model (IL, I0, Rs, Rsh and ideality factor n) to every IV curve, e.g. the voltage and current of each ivdatImports dataset.
+    voltage and current are lists of per-curve arrays or NaN-padded (curves, points) arrays. cells is the number of series cells and
+    temperature the cell temperature in degrees C, used to turn the fitted a = n * cells * kT / q into n.
+    Starting points come from diodeGuess for all curves at once. The curves are then fitted chunkSize at a time by a batched
+    Levenberg-Marquardt solver (each curve with its own damping, stopping when an accepted step improves the cost by less than
+    `tolerance`), with the chunks spread over a process pool when processes > 1 (processes = None uses one per CPU).
+    Returns a structured array with one DIODE_DTYPE row per curve. Curves that cannot be fitted (no Isc, Voc or power point) are NaN with success = False.
+    '''
+    voltage = _curveStack(voltage)
+    current = _curveStack(current)
+    thermal = cells * BOLTZMANN * (temperature + 273.15) / ELEMENTARY_CHARGE
+    items = [(voltage[first:first + chunkSize], current[first:first + chunkSize], thermal, maxIterations, tolerance) for first in range(0, len(voltage), chunkSize)]
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(items) <= 1:
+        results = [_diodeFitChunk(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers = min(processes, len(items))) as pool:
+            results = list(pool.map(_diodeFitChunk, items))
+
+    return np.concatenate(results) if results else np.zeros(0, dtype = DIODE_DTYPE)
+
+
+def ivCrossCheck(results, footers, rtol = 0.02):
+    '''
+    ivCrossCheck compares extracted parameters (from ivParameters) with the values the instrument wrote in each file's footer.
+    footers is a list of footer dictionaries (as read by sciFileParse), one per curve. Unreadable or missing footer values are NaN.
+    Returns a DataFrame with, for each of Voc, Isc, Pmax and FF, the footer value, the relative difference and whether it is within rtol.
+    '''
+    frame = pd.DataFrame(index = range(len(footers)))
+    for parameter, field in FOOTER_FIELDS.items():
+        footer = pd.to_numeric(pd.Series([footer.get(field) for footer in footers], dtype = object), errors = 'coerce').to_numpy(dtype = np.float64)
+        computed = np.asarray(results[parameter], dtype = np.float64)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            difference = np.abs(computed - footer) / np.abs(footer)
+        # Both zero (e.g. Pmax of a short-circuit-only log) agrees.
+        difference = np.where((computed == 0) & (footer == 0), 0.0, difference)
+        frame['Footer ' + parameter] = footer
+        frame[parameter + ' Difference [%]'] = difference * 100
+        frame[parameter + ' OK'] = difference <= rtol
+    return frame
+
+
+def ivBatch(files, rtol = 0.02):
+    '''
+    ivBatch reads any number of .ivdat files (uploads or paths), extracts the IV parameters of all of them in one pass with ivParameters,
+    and cross-checks each against its footer with ivCrossCheck.
+    Files that cannot be read, or have fewer than 2 data points, are skipped and listed in 'skipped' with the reason.
+    Returns a dictionary with the 'table' (one row per file: computed parameters, footer values and checks) and 'skipped'.
+    '''
+    names, voltages, currents, footers, skipped = [], [], [], [], []
+    for name, content in fileContents(files):
+        try:
+            parsed = sciFileParse(content)
+            voltageName = [column for column in parsed['columns'] if 'voltage' in column.lower()]
+            currentName = [column for column in parsed['columns'] if 'current' in column.lower()]
+            if not voltageName or not currentName:
+                raise ValueError('no voltage or current column (found ' + ', '.join(parsed['columns']) + ')')
+            points = np.isfinite(np.asarray(parsed['data'][voltageName[0]], dtype = np.float64)) & np.isfinite(np.asarray(parsed['data'][currentName[0]], dtype = np.float64))
+            if points.sum() < 2:
+                raise ValueError('fewer than 2 data points')
+        except (ValueError, UnicodeDecodeError) as error:
+            skipped.append({'Upload Name': name, 'Status': str(error)})
+            print('The following datafile could not be analyzed and will be ignored: ' + name + ' (' + str(error) + ')')
+            continue
+        voltageName, currentName = voltageName[0], currentName[0]
+        names.append(parsed['header'].get('FileName', name))
+        voltages.append(parsed['data'][voltageName])
+        currents.append(parsed['data'][currentName])
+        footers.append(parsed['footer'])
+
+    results = ivParameters(voltages, currents) if names else {parameter: np.empty(0) for parameter in ('Isc', 'Voc', 'Pmax', 'Vmp', 'Imp', 'FF')}
+    table = pd.DataFrame({
+        'Filename': names,
+        'Isc [A]': results['Isc'],
+        'Voc [V]': results['Voc'],
+        'Pmax [W]': results['Pmax'],
+        'Vmp [V]': results['Vmp'],
+        'Imp [A]': results['Imp'],
+        'FF [%]': results['FF'],
+    })
+    table = pd.concat([table, ivCrossCheck(results, footers, rtol)], axis = 1)
+
+    theDictionary = {
+        'table': table,
+        'skipped': pd.DataFrame(skipped, columns = ['Upload Name', 'Status']),
+    }
+    return theDictionary
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial non-uniformity from camera images of the target plane. The frame is memory-mapped where the file format allows it and is
+processed in bands of rows, so the memory used depends on the band size and not on the size of the image.
+"""
+import os
+import io
+import numpy as np
+from PIL import Image
+from .NUAnalysis import nonUniformity, nuClass
+
+IMAGE_BLOCK_BYTES = 64 * 2 ** 20        # size of one band of rows as float64 pixels, including its dark/flat bands
+TIFF_FORMATS = {1: 'u', 2: 'i', 3: 'f'}  # TIFF SampleFormat tag -> NumPy kind
+
+
+def _tiffMap(path):
+    '''
+    Memory-maps the first frame of an uncompressed, stripped TIFF whose strips are stored back to back (the usual camera layout).
+    Returns None for any other TIFF, which then has to be decoded in memory.
+    '''
+    with Image.open(path) as image:
+        tags = image.tag_v2
+        offsets = tags.get(273)
+        counts = tags.get(279)
+        bits = tags.get(258, (8,))
+        bits = bits if isinstance(bits, tuple) else (bits,)
+        samples = tags.get(277, 1)
+        if tags.get(259, 1) != 1 or tags.get(322) is not None or offsets is None or tags.get(284, 1) != 1 or len(set(bits)) != 1 or bits[0] % 8:
+            return None
+        offsets, counts = np.atleast_1d(offsets), np.atleast_1d(counts)
+        if (offsets[1:] != offsets[:-1] + counts[:-1]).any():
+            return None
+        dtype = np.dtype(('>' if tags.prefix == b'MM' else '<') + TIFF_FORMATS.get(tags.get(339, 1), 'u') + str(bits[0] // 8))
+        shape = (image.height, image.width) if samples == 1 else (image.height, image.width, samples)
+    return np.memmap(path, dtype = dtype, mode = 'r', offset = int(offsets[0]), shape = shape)
+
+
+def imageOpen(source, shape = None, dtype = None, offset = 0):
+    '''
+    imageOpen returns a camera frame as an array without reading it into memory where possible.
+        .npy                memory-mapped
+        .raw / .bin         memory-mapped; needs the frame shape (rows, columns) and dtype, and the header size as offset (bytes)
+        .tif / .tiff        memory-mapped if uncompressed and stripped, otherwise decoded in memory
+        other images (PNG)  decoded in memory (compressed formats cannot be mapped; convert large frames to .npy once)
+    source can be a path or an uploaded file object (anything with .name and .getvalue() or .read()); uploads are already in memory.
+    '''
+    isPath = isinstance(source, (str, os.PathLike))
+    name = os.fspath(source) if isPath else source.name
+    extension = os.path.splitext(name)[1].lower()
+    if not isPath:
+        source = io.BytesIO(source.getvalue() if hasattr(source, 'getvalue') else source.read())
+
+    if extension == '.npy':
+        return np.load(source, mmap_mode = 'r' if isPath else None)
+    if extension in ('.raw', '.bin'):
+        if shape is None or dtype is None:
+            raise ValueError('Raw frames need their shape and dtype.')
+        if isPath:
+            return np.memmap(source, dtype = dtype, mode = 'r', offset = offset, shape = tuple(shape))
+        return np.frombuffer(source.getvalue(), dtype = dtype, count = int(np.prod(shape)), offset = offset).reshape(shape)
+    if extension in ('.tif', '.tiff') and isPath:
+        frame = _tiffMap(source)
+        if frame is not None:
+            return frame
+    print(os.path.basename(name) + ' cannot be memory-mapped and is read into memory.')
+    with Image.open(source) as image:
+        return np.asarray(image)
+
+
+def _band(source, first, last, width):
+    '''
+    Returns rows first..last - 1 and the first `width` columns of a frame as float64 (colour frames averaged over their channels),
+    or source itself if it is a scalar (e.g. a constant dark level).
+    '''
+    if source is None or np.isscalar(source):
+        return source
+    band = np.array(source[first:last, :width], dtype = np.float64)
+    return band[..., :3].mean(axis = 2) if band.ndim == 3 else band
+
+
+def imageNU(frame, pixelSize, cellSize, dark = None, flat = None, roi = None, blockBytes = IMAGE_BLOCK_BYTES):
+    '''
+    imageNU calculates the spatial non-uniformity of a camera frame of the target plane.
+    The frame is dark-subtracted (dark: a frame or a constant level) and flat-field corrected (flat: a frame of a uniform source, taken
+    with the same dark), then binned into square cells of cellSize cm, the detector size of a point scan. pixelSize is the size
+    of one pixel on the target plane [cm]; roi = (first row, last row, first column, last column) limits the analysis to the target area.
+    The frame is read in bands of whole cell rows of about blockBytes each (peak memory is about twice that), so a memory-mapped
+    50 MP frame is never held in memory; only the binned cell map is. Dead flat-field pixels are left out of their cell. Pixels that do not fill a whole cell at the right and bottom edges are left out.
+    Returns a dictionary with the cell map as a gridBuild-style 'grid' (z, y, x; y upwards, i.e. the image flipped), 'xAxis', 'yAxis',
+    'zAxis' [cm], the cell 'NU' [%], 'class', 'max', 'min', 'mean', 'std', the 'pixelNU' [%] of the corrected pixels, and the 'binning'.
+    '''
+    if roi is not None:
+        window = (slice(roi[0], roi[1]), slice(roi[2], roi[3]))
+        frame = frame[window]
+        dark = dark if dark is None or np.isscalar(dark) else dark[window]
+        flat = flat if flat is None else flat[window]
+    binning = max(int(round(cellSize / pixelSize)), 1)
+    cellRows, cellColumns = frame.shape[0] // binning, frame.shape[1] // binning
+    if cellRows == 0 or cellColumns == 0:
+        raise ValueError('The frame is smaller than one ' + str(cellSize) + ' cm cell.')
+    width = cellColumns * binning
+    arrays = 1 + (dark is not None and not np.isscalar(dark)) + 2 * (flat is not None)
+    bandCells = max(int(blockBytes // (arrays * 8 * binning * width)), 1)
+    bands = [(first, min(first + bandCells, cellRows)) for first in range(0, cellRows, bandCells)]
+
+    # The flat field is scaled to a mean of 1 over the analyzed area, which takes one pass of its own.
+    if flat is not None:
+        total = 0.0
+        for first, last in bands:
+            total += (_band(flat, first * binning, last * binning, width) - (_band(dark, first * binning, last * binning, width) if dark is not None else 0)).sum()
+        flatMean = total / (cellRows * binning * width)
+
+    cells = np.empty((cellRows, cellColumns))
+    high, low = -np.inf, np.inf
+    for first, last in bands:
+        block = _band(frame, first * binning, last * binning, width)
+        darkBand = _band(dark, first * binning, last * binning, width) if dark is not None else 0
+        block -= darkBand
+        shape = (last - first, binning, cellColumns, binning)
+        if flat is None:
+            high, low = max(high, block.max()), min(low, block.min())
+            cells[first:last] = block.reshape(shape).mean(axis = (1, 3))
+            continue
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            block /= (_band(flat, first * binning, last * binning, width) - darkBand) / flatMean
+        # Dead flat-field pixels are left out of their cell's mean.
+        good = np.isfinite(block)
+        block[~good] = 0
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            cells[first:last] = block.reshape(shape).sum(axis = (1, 3)) / good.reshape(shape).sum(axis = (1, 3))
+        if good.any():
+            high, low = max(high, block[good].max()), min(low, block[good].min())
+
+    grid = np.ma.masked_invalid(cells[::-1])
+    NU = nonUniformity(grid.max(), grid.min())
+    step = binning * pixelSize
+    theDictionary = {
+        'grid': grid[None],
+        'xAxis': (np.arange(cellColumns) + 0.5) * step,
+        'yAxis': (np.arange(cellRows) + 0.5) * step,
+        'zAxis': np.zeros(1),
+        'NU': NU,
+        'class': nuClass(NU),
+        'max': grid.max(),
+        'min': grid.min(),
+        'mean': grid.mean(),
+        'std': grid.std(),
+        'pixelNU': nonUniformity(high, low),
+        'binning': binning,
+    }
+    return theDictionary
@@ -0,0 +1,765 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial non-uniformity (NU) analysis helpers for .sudat scans.
+"""
+import hashlib
+import numpy as np
+from scipy import fft as sfft, sparse
+from scipy.interpolate import griddata, PchipInterpolator, RectBivariateSpline, RBFInterpolator
+from scipy.ndimage import maximum_filter, minimum_filter
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+# IEC 60904-9 Ed.3 upper limits of spatial non-uniformity [%] for each class.
+NU_LIMITS = {'A+': 1.0, 'A': 2.0, 'B': 5.0, 'C': 10.0}
+
+SURFACE_CACHE_SIZE = 16     # interpolated surfaces kept per process
+_surfaceCache = {}
+
+
+def _axisIndex(coords, decimals):
+    '''
+    Rounds a coordinate column to the stage resolution and returns (axis values, index of each point on that axis).
+    NaN coordinates (e.g. the Z column of single-plane scans) collapse onto a single axis entry.
+    '''
+    coords = np.asarray(coords, dtype = np.float64)
+    rounded = np.round(np.where(np.isnan(coords), 0.0, coords), decimals)
+    axis, index = np.unique(rounded, return_inverse = True)
+    return axis, index.reshape(-1)
+
+
+def gridBuild(Xs, Ys, Zs, signal, decimals = 4):
+    '''
+    gridBuild scatters rectangular scan points onto a 3-D (z, y, x) grid in a single vectorized pass.
+    The axes are worked out from the coordinates themselves (rounded to `decimals` places, in cm) rather than from the file header.
+    Grid cells that were never measured (aborted scans, skipped points) or that hold a NaN signal are masked.
+    If a position was measured more than once, the last reading is kept.
+    Returns a dictionary with the masked 'grid' and the 'xAxis', 'yAxis', 'zAxis' coordinate arrays.
+    '''
+    xAxis, xIndex = _axisIndex(Xs, decimals)
+    yAxis, yIndex = _axisIndex(Ys, decimals)
+    zAxis, zIndex = _axisIndex(Zs, decimals)
+
+    grid = np.full((len(zAxis), len(yAxis), len(xAxis)), np.nan)
+    grid[zIndex, yIndex, xIndex] = np.asarray(signal, dtype = np.float64)
+
+    theDictionary = {
+        'grid': np.ma.masked_invalid(grid),
+        'xAxis': xAxis,
+        'yAxis': yAxis,
+        'zAxis': zAxis,
+    }
+    return theDictionary
+
+
+def nuClass(NU):
+    '''
+    nuClass returns the IEC 60904-9 non-uniformity class ('A+', 'A', 'B', 'C' or 'U' when outside all classes) for an NU value in %,
+    or an array of classes for an array of values.
+    '''
+    NU = np.asarray(NU, dtype = np.float64)
+    classes = np.select([NU <= limit for limit in NU_LIMITS.values()], list(NU_LIMITS.keys()), 'U')
+    return str(classes[()]) if classes.ndim == 0 else classes
+
+
+def nonUniformity(high, low):
+    '''
+    nonUniformity returns the IEC 60904-9 spatial non-uniformity 100 * |(max - min) / (max + min)| in % (element-wise for arrays).
+    '''
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return 100 * np.abs((high - low) / (high + low))
+
+
+def _summedArea(values):
+    '''
+    Returns the summed-area table of a 2-D array with a leading row and column of zeros, so any block sum is four lookups.
+    '''
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    table[1:, 1:] = values.cumsum(axis = 0).cumsum(axis = 1)
+    return table
+
+
+def nuIndex(gridData, plane = 0):
+    '''
+    nuIndex prepares one plane of a gridBuild grid for constant-time statistics of any axis-aligned sub-rectangle.
+    Summed-area tables give the point count, mean and standard deviation; 2-D sparse tables (the max and min of every
+    2^i x 2^j block) give the max and min from four overlapping blocks. Unmeasured (masked) cells are ignored.
+    Building costs O(N log^2 N) for N grid cells; every query afterwards is O(1).
+    Returns a dictionary used by nuQuery and nuBestWindow.
+    '''
+    grid = np.ma.asarray(gridData['grid'])
+    grid = grid[plane] if grid.ndim == 3 else grid
+    values = grid.filled(np.nan).astype(np.float64)
+    measured = np.isfinite(values)
+    # Sums are taken about the plane mean so the variance does not lose precision to cancellation.
+    offset = values[measured].mean() if measured.any() else 0.0
+    filled = np.where(measured, values - offset, 0.0)
+
+    rows, columns = values.shape
+    highs, lows = {}, {}
+    highRow = [np.where(measured, values, -np.inf)]
+    lowRow = [np.where(measured, values, np.inf)]
+    # Levels along y, then along x for each of them.
+    for ky in range(1, int(np.log2(rows)) + 1):
+        half = 1 << (ky - 1)
+        highRow.append(np.maximum(highRow[-1][:-half], highRow[-1][half:]))
+        lowRow.append(np.minimum(lowRow[-1][:-half], lowRow[-1][half:]))
+    for ky in range(len(highRow)):
+        high, low = highRow[ky], lowRow[ky]
+        highs[ky, 0], lows[ky, 0] = high, low
+        for kx in range(1, int(np.log2(columns)) + 1):
+            half = 1 << (kx - 1)
+            high = np.maximum(high[:, :-half], high[:, half:])
+            low = np.minimum(low[:, :-half], low[:, half:])
+            highs[ky, kx], lows[ky, kx] = high, low
+
+    theDictionary = {
+        'xAxis': np.asarray(gridData['xAxis']),
+        'yAxis': np.asarray(gridData['yAxis']),
+        'offset': offset,
+        'count': _summedArea(measured.astype(np.float64)),
+        'sum': _summedArea(filled),
+        'sumSquares': _summedArea(filled ** 2),
+        'highs': highs,
+        'lows': lows,
+    }
+    return theDictionary
+
+
+def _blockStats(index, row0, row1, col0, col1):
+    '''
+    Statistics of the cell blocks rows row0..row1, columns col0..col1 (inclusive). The bounds can be arrays of equal-sized blocks.
+    '''
+    row0, row1, col0, col1 = (np.asarray(bound) for bound in (row0, row1, col0, col1))
+    ky = int(np.log2(int(np.max(row1 - row0)) + 1))
+    kx = int(np.log2(int(np.max(col1 - col0)) + 1))
+    rowB, colB = row1 - (1 << ky) + 1, col1 - (1 << kx) + 1
+    high, low = index['highs'][ky, kx], index['lows'][ky, kx]
+    maximum = np.maximum(np.maximum(high[row0, col0], high[rowB, col0]), np.maximum(high[row0, colB], high[rowB, colB]))
+    minimum = np.minimum(np.minimum(low[row0, col0], low[rowB, col0]), np.minimum(low[row0, colB], low[rowB, colB]))
+
+    def blockSum(table):
+        return table[row1 + 1, col1 + 1] - table[row0, col1 + 1] - table[row1 + 1, col0] + table[row0, col0]
+    count = blockSum(index['count'])
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = blockSum(index['sum']) / count
+        std = np.sqrt(np.maximum(blockSum(index['sumSquares']) / count - mean ** 2, 0))
+    mean = mean + index['offset']
+
+    empty = count == 0
+    theDictionary = {
+        'NU': np.where(empty, np.nan, nonUniformity(maximum, minimum)),
+        'max': np.where(empty, np.nan, maximum),
+        'min': np.where(empty, np.nan, minimum),
+        'mean': mean,
+        'std': std,
+        'count': count.astype(int),
+    }
+    return theDictionary
+
+
+def nuQuery(index, xRange, yRange):
+    '''
+    nuQuery returns the non-uniformity of the measurement points inside a sub-rectangle of the scan in O(1).
+    xRange and yRange are (low, high) point-centre positions in cm, inclusive.
+    Returns a dictionary with 'NU' [%], 'class', 'max', 'min', 'mean', 'std' (in the units of the grid) and 'count' (points used).
+    '''
+    col0, col1 = np.searchsorted(index['xAxis'], xRange[0] - 1e-9, side = 'left'), np.searchsorted(index['xAxis'], xRange[1] + 1e-9, side = 'right') - 1
+    row0, row1 = np.searchsorted(index['yAxis'], yRange[0] - 1e-9, side = 'left'), np.searchsorted(index['yAxis'], yRange[1] + 1e-9, side = 'right') - 1
+    if col1 < col0 or row1 < row0:
+        raise ValueError('The requested area contains no measurement points.')
+    stats = {key: value[()] for key, value in _blockStats(index, row0, row1, col0, col1).items()}
+    stats['class'] = nuClass(stats['NU'])
+    return stats
+
+
+def _windowSize(xAxis, yAxis, width, height = None):
+    '''
+    Returns the (across, down) number of grid points in a width x height cm window (square if height is None).
+    '''
+    height = width if height is None else height
+    xStep = np.diff(xAxis).min() if len(xAxis) > 1 else 1.0
+    yStep = np.diff(yAxis).min() if len(yAxis) > 1 else 1.0
+    across = max(int(np.floor(width / xStep + 1e-9)), 1)
+    down = max(int(np.floor(height / yStep + 1e-9)), 1)
+    if across > len(xAxis) or down > len(yAxis):
+        raise ValueError('A ' + str(width) + ' x ' + str(height) + ' cm window does not fit in the scanned area.')
+    return across, down
+
+
+def nuBestWindow(index, width, height = None):
+    '''
+    nuBestWindow slides a width x height cm window (square if height is None) over every placement on the scan grid and finds the one
+    with the lowest non-uniformity. A window holds the points whose detector cells fit inside it, i.e. floor(width / spacing) points
+    across (a 3 cm window at 0.625 cm spacing holds 4 points).
+    Every placement is evaluated at once from the index.
+    Returns a dictionary with the best 'NU' [%], its 'class', the 'xRange' and 'yRange' of point centres it covers, the 'center' [cm],
+    and 'map', the NU of every placement (rows follow yAxis, columns xAxis, indexed by the window's first point).
+    '''
+    xAxis, yAxis = index['xAxis'], index['yAxis']
+    across, down = _windowSize(xAxis, yAxis, width, height)
+
+    row0, col0 = np.meshgrid(np.arange(len(yAxis) - down + 1), np.arange(len(xAxis) - across + 1), indexing = 'ij')
+    stats = _blockStats(index, row0, row0 + down - 1, col0, col0 + across - 1)
+    NU = stats['NU']
+    best = np.unravel_index(np.nanargmin(NU), NU.shape)
+    xRange = (xAxis[best[1]], xAxis[best[1] + across - 1])
+    yRange = (yAxis[best[0]], yAxis[best[0] + down - 1])
+
+    theDictionary = {
+        'NU': NU[best],
+        'class': nuClass(NU[best]),
+        'xRange': xRange,
+        'yRange': yRange,
+        'center': ((xRange[0] + xRange[1]) / 2, (yRange[0] + yRange[1]) / 2),
+        'points': across * down,
+        'map': NU,
+    }
+    return theDictionary
+
+
+def pointIndex(Xs, Ys, signal, center = None):
+    '''
+    pointIndex builds a spatial index over scattered scan points (circular scans) for fast area queries.
+    The points are held in a KD-tree for circles around any centre, and sorted by distance from `center` (default: the middle of the scanned
+    extent) with running max/min, so concentric disc statistics are a binary search and the largest disc meeting a class is a single pass.
+    Returns a dictionary used by nuCircle, nuAnnulus, radialProfile, azimuthalProfile and classDiameters.
+    '''
+    Xs = np.asarray(Xs, dtype = np.float64)
+    Ys = np.asarray(Ys, dtype = np.float64)
+    signal = np.asarray(signal, dtype = np.float64)
+    if center is None:
+        center = ((Xs.min() + Xs.max()) / 2, (Ys.min() + Ys.max()) / 2)
+    radius = np.hypot(Xs - center[0], Ys - center[1])
+    order = np.argsort(radius, kind = 'stable')
+    # Running sums are taken about the mean so the variance does not lose precision to cancellation.
+    offset = signal.mean()
+    centered = signal[order] - offset
+
+    theDictionary = {
+        'tree': cKDTree(np.column_stack((Xs, Ys))),
+        'signal': signal,
+        'center': center,
+        'radius': radius,
+        'angle': np.arctan2(Ys - center[1], Xs - center[0]),
+        'order': order,
+        'sortedRadius': radius[order],
+        'runningMax': np.maximum.accumulate(signal[order]),
+        'runningMin': np.minimum.accumulate(signal[order]),
+        'runningSum': np.cumsum(centered),
+        'runningSumSquares': np.cumsum(centered ** 2),
+        'offset': offset,
+    }
+    return theDictionary
+
+
+def _pointStats(values):
+    '''
+    NU [%], class and summary statistics of a set of point readings (NaN if there are none).
+    '''
+    if len(values) == 0:
+        return {'NU': np.nan, 'class': 'U', 'max': np.nan, 'min': np.nan, 'mean': np.nan, 'std': np.nan, 'count': 0}
+    NU = nonUniformity(values.max(), values.min())
+    return {'NU': NU, 'class': nuClass(NU), 'max': values.max(), 'min': values.min(), 'mean': values.mean(), 'std': values.std(), 'count': len(values)}
+
+
+def nuCircle(index, radius, center = None):
+    '''
+    nuCircle returns the non-uniformity of the points within `radius` cm of `center` (default: the index centre).
+    Concentric discs come straight from the running max/min and sums (a binary search); other centres use the KD-tree.
+    Returns a dictionary with 'NU' [%], 'class', 'max', 'min', 'mean', 'std' and 'count'.
+    '''
+    if center is None:
+        count = np.searchsorted(index['sortedRadius'], radius + 1e-9, side = 'right')
+        if count == 0:
+            return _pointStats(np.empty(0))
+        last = count - 1
+        mean = index['runningSum'][last] / count
+        NU = nonUniformity(index['runningMax'][last], index['runningMin'][last])
+        theDictionary = {
+            'NU': NU,
+            'class': nuClass(NU),
+            'max': index['runningMax'][last],
+            'min': index['runningMin'][last],
+            'mean': mean + index['offset'],
+            'std': np.sqrt(max(index['runningSumSquares'][last] / count - mean ** 2, 0)),
+            'count': count,
+        }
+        return theDictionary
+    return _pointStats(index['signal'][index['tree'].query_ball_point(center, radius + 1e-9)])
+
+
+def nuAnnulus(index, inner, outer):
+    '''
+    nuAnnulus returns the non-uniformity of the points between `inner` (inclusive) and `outer` (inclusive) cm from the index centre.
+    '''
+    first = np.searchsorted(index['sortedRadius'], inner - 1e-9, side = 'left')
+    last = np.searchsorted(index['sortedRadius'], outer + 1e-9, side = 'right')
+    return _pointStats(index['signal'][index['order'][first:last]])
+
+
+def _profile(index, coordinate, edges):
+    '''
+    Mean, standard deviation, min, max and count of the readings in each bin of `coordinate`, from a few bincounts.
+    '''
+    signal = index['signal']
+    bins = np.searchsorted(edges, coordinate, side = 'right') - 1
+    bins[coordinate == edges[-1]] = len(edges) - 2
+    inside = (bins >= 0) & (bins < len(edges) - 1)
+    bins, values = bins[inside], signal[inside]
+    size = len(edges) - 1
+    count = np.bincount(bins, minlength = size)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = np.bincount(bins, values, minlength = size) / count
+        std = np.sqrt(np.maximum(np.bincount(bins, values ** 2, minlength = size) / count - mean ** 2, 0))
+    high = np.full(size, -np.inf)
+    low = np.full(size, np.inf)
+    np.maximum.at(high, bins, values)
+    np.minimum.at(low, bins, values)
+    empty = count == 0
+
+    theDictionary = {
+        'edges': edges,
+        'mean': mean,
+        'std': std,
+        'max': np.where(empty, np.nan, high),
+        'min': np.where(empty, np.nan, low),
+        'count': count,
+    }
+    return theDictionary
+
+
+def radialProfile(index, rings = 10):
+    '''
+    radialProfile bins the readings into `rings` concentric rings of equal width (or at the ring edges given as an array, in cm)
+    and returns their 'mean', 'std', 'max', 'min' and 'count' with the ring 'edges'.
+    '''
+    edges = np.linspace(0, index['sortedRadius'][-1], rings + 1) if np.isscalar(rings) else np.asarray(rings, dtype = np.float64)
+    return _profile(index, index['radius'], edges)
+
+
+def azimuthalProfile(index, sectors = 12, inner = 0, outer = np.inf):
+    '''
+    azimuthalProfile bins the readings between `inner` and `outer` cm from the centre into `sectors` equal angular sectors
+    (edges in degrees, counter-clockwise from +x) and returns their 'mean', 'std', 'max', 'min' and 'count' with the sector 'edges'.
+    '''
+    within = (index['radius'] >= inner) & (index['radius'] <= outer)
+    angle = np.where(within, np.degrees(index['angle']) % 360, np.nan)
+    return _profile(index, angle, np.linspace(0, 360, sectors + 1))
+
+
+def classDiameters(index):
+    '''
+    classDiameters finds, for each IEC class, the largest concentric disc (through point centres) whose points meet that class.
+    Points at equal distance from the centre are taken together. Returns {class: diameter in cm, or 0 if not even the centre group qualifies}.
+    '''
+    NU = nonUniformity(index['runningMax'], index['runningMin'])
+    # Only the last point of each equal-radius group is a valid disc boundary.
+    groupEnd = np.append(index['sortedRadius'][1:] > index['sortedRadius'][:-1] + 1e-9, True)
+    diameters = {}
+    for label, limit in NU_LIMITS.items():
+        # NU over a growing disc never decreases, so the qualifying discs are a prefix.
+        qualifying = np.nonzero(groupEnd & (NU <= limit))[0]
+        qualifying = qualifying[qualifying < np.argmax(NU > limit)] if (NU > limit).any() else qualifying
+        diameters[label] = float(2 * index['sortedRadius'][qualifying[-1]]) if len(qualifying) else 0.0
+    return diameters
+
+
+def nuPlanes(gridData, subAreas = None):
+    '''
+    nuPlanes calculates the non-uniformity of every z plane of a gridBuild grid in one pass over the (z, y, x) stack.
+    subAreas is an optional list of sub-area sizes in cm (a number for a square, or a (width, height) pair); for each, the best-placed
+    window on every plane is found with running max/min filters over the whole stack, matching nuBestWindow plane by plane.
+    Unmeasured (masked) cells are ignored; a plane with no readings gives NaN.
+    Returns a dictionary of per-plane arrays: 'z' [cm], 'NU' [%], 'class', 'max', 'min', 'mean', 'std', 'count', and 'subAreas',
+    {(width, height): {'NU', 'class', 'center'}} with the best window's NU, class and (x, y) centre [cm] on each plane.
+    '''
+    grid = np.ma.masked_invalid(np.ma.asarray(gridData['grid']).filled(np.nan).astype(np.float64))
+    xAxis, yAxis = np.asarray(gridData['xAxis']), np.asarray(gridData['yAxis'])
+    values = grid.filled(np.nan)
+    measured = ~np.ma.getmaskarray(grid)
+    highs = np.where(measured, values, -np.inf)
+    lows = np.where(measured, values, np.inf)
+
+    count = measured.sum(axis = (1, 2))
+    empty = count == 0
+    high = np.where(empty, np.nan, highs.max(axis = (1, 2)))
+    low = np.where(empty, np.nan, lows.min(axis = (1, 2)))
+    NU = nonUniformity(high, low)
+
+    windows = {}
+    for size in (subAreas or []):
+        width, height = (size, size) if np.isscalar(size) else size
+        across, down = _windowSize(xAxis, yAxis, width, height)
+        # The filters are centred; shift the origin so entry (z, i, j) covers rows i..i + down - 1 and columns j..j + across - 1.
+        shape = (1, down, across)
+        origin = (0, -(down // 2), -(across // 2))
+        rows, columns = len(yAxis) - down + 1, len(xAxis) - across + 1
+        windowHigh = maximum_filter(highs, size = shape, origin = origin)[:, :rows, :columns]
+        windowLow = minimum_filter(lows, size = shape, origin = origin)[:, :rows, :columns]
+        with np.errstate(invalid = 'ignore'):
+            windowNU = nonUniformity(windowHigh, windowLow).reshape(len(NU), -1)
+        best = np.argmin(np.where(np.isnan(windowNU), np.inf, windowNU), axis = 1)
+        bestNU = windowNU[np.arange(len(NU)), best]
+        row, column = np.unravel_index(best, (rows, columns))
+        windows[(width, height)] = {
+            'NU': bestNU,
+            'class': nuClass(bestNU),
+            'center': np.column_stack(((xAxis[column] + xAxis[column + across - 1]) / 2, (yAxis[row] + yAxis[row + down - 1]) / 2)),
+        }
+
+    theDictionary = {
+        'z': np.asarray(gridData['zAxis']),
+        'NU': NU,
+        'class': nuClass(NU),
+        'max': high,
+        'min': low,
+        'mean': grid.mean(axis = (1, 2)).filled(np.nan),
+        'std': grid.std(axis = (1, 2)).filled(np.nan),
+        'count': count,
+        'subAreas': windows,
+    }
+    return theDictionary
+
+
+def pointPlanes(Xs, Ys, Zs, signal, decimals = 4):
+    '''
+    pointPlanes calculates the non-uniformity of every z plane of a scattered (circular) scan. The per-plane statistics come from
+    a few bincounts over all points at once; the largest concentric disc meeting each class (see classDiameters) is found per plane.
+    Returns a dictionary of per-plane arrays: 'z' [cm], 'NU' [%], 'class', 'max', 'min', 'mean', 'std', 'count', and 'diameters',
+    {class: largest diameter [cm] on each plane}.
+    '''
+    Xs = np.asarray(Xs, dtype = np.float64)
+    Ys = np.asarray(Ys, dtype = np.float64)
+    signal = np.asarray(signal, dtype = np.float64)
+    zAxis, zIndex = _axisIndex(Zs, decimals)
+    planes = len(zAxis)
+
+    count = np.bincount(zIndex, minlength = planes)
+    mean = np.bincount(zIndex, signal, minlength = planes) / count
+    std = np.sqrt(np.maximum(np.bincount(zIndex, signal ** 2, minlength = planes) / count - mean ** 2, 0))
+    high = np.full(planes, -np.inf)
+    low = np.full(planes, np.inf)
+    np.maximum.at(high, zIndex, signal)
+    np.minimum.at(low, zIndex, signal)
+    NU = nonUniformity(high, low)
+
+    diameters = {label: np.zeros(planes) for label in NU_LIMITS}
+    for plane in range(planes):
+        onPlane = zIndex == plane
+        for label, diameter in classDiameters(pointIndex(Xs[onPlane], Ys[onPlane], signal[onPlane])).items():
+            diameters[label][plane] = diameter
+
+    theDictionary = {
+        'z': zAxis,
+        'NU': NU,
+        'class': nuClass(NU),
+        'max': high,
+        'min': low,
+        'mean': mean,
+        'std': std,
+        'count': count,
+        'diameters': diameters,
+    }
+    return theDictionary
+
+
+def workingDistance(z, NU, points = 200):
+    '''
+    workingDistance recommends the z position with the lowest non-uniformity from the NU measured on several planes.
+    The minimum is refined between planes with a parabola through the best plane and its two neighbours; if the best plane is the first
+    or last one, the optimum may lie outside the scanned range and that plane is returned with 'edge' = True.
+    Returns a dictionary with the recommended 'z' [cm], the expected 'NU' [%] there, the best measured 'plane' index, 'edge',
+    and a smooth (shape-preserving) NU(z) curve as 'curveZ' and 'curveNU' for plotting.
+    '''
+    z = np.asarray(z, dtype = np.float64)
+    NU = np.asarray(NU, dtype = np.float64)
+    valid = np.isfinite(NU)
+    if not valid.any():
+        raise ValueError('No plane has a valid non-uniformity.')
+    z, NU = z[valid], NU[valid]
+    best = int(np.argmin(NU))
+    edge = len(NU) > 1 and best in (0, len(NU) - 1)
+    bestZ, bestNU = z[best], NU[best]
+
+    if 0 < best < len(NU) - 1:
+        a, b, c = np.polyfit(z[best - 1:best + 2], NU[best - 1:best + 2], 2)
+        if a > 0:
+            bestZ = float(np.clip(-b / (2 * a), z[best - 1], z[best + 1]))
+            bestNU = max(float(np.polyval((a, b, c), bestZ)), 0.0)
+    elif edge:
+        print('The lowest non-uniformity is on the ' + ('first' if best == 0 else 'last') + ' plane scanned (z = ' + str(z[best])
+              + ' cm); the optimum may lie outside the scanned range.')
+
+    curveZ = np.linspace(z[0], z[-1], points) if len(z) > 1 else z
+    theDictionary = {
+        'z': bestZ,
+        'NU': bestNU,
+        'plane': int(np.nonzero(valid)[0][best]),
+        'edge': edge,
+        'curveZ': curveZ,
+        'curveNU': PchipInterpolator(z, NU)(curveZ) if len(z) > 1 else NU,
+    }
+    return theDictionary
+
+
+def _scanHash(*arrays):
+    '''
+    Returns the SHA-1 hex digest of the contents of the given arrays, as float64, so identical scans share cache entries.
+    '''
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array, dtype = np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _cached(key, compute):
+    '''
+    Returns the cached value for key, computing and storing it first if needed. The oldest entry is dropped once the cache is full.
+    '''
+    if key not in _surfaceCache:
+        if len(_surfaceCache) >= SURFACE_CACHE_SIZE:
+            _surfaceCache.pop(next(iter(_surfaceCache)))
+        _surfaceCache[key] = compute()
+    return _surfaceCache[key]
+
+
+def nuSurface(Xs, Ys, signal, resolution = 200, method = 'linear'):
+    '''
+    nuSurface interpolates scattered scan readings (e.g. a circular scan) onto a regular resolution x resolution grid over the scanned extent
+    with scipy griddata ('linear', 'cubic' or 'nearest'). Grid points outside the convex hull of the scan are NaN.
+    The surface is computed once per scan content and parameters and then served from a per-process cache.
+    Returns a dictionary with the 'surface' (rows follow yAxis), its 'xAxis' and 'yAxis' [cm], the same surface as a masked 'grid'
+    (so it can be passed to nuIndex or surfaceIndex) and the cache 'key'.
+    '''
+    Xs = np.asarray(Xs, dtype = np.float64)
+    Ys = np.asarray(Ys, dtype = np.float64)
+    signal = np.asarray(signal, dtype = np.float64)
+
+    def compute():
+        xAxis = np.linspace(Xs.min(), Xs.max(), resolution)
+        yAxis = np.linspace(Ys.min(), Ys.max(), resolution)
+        surface = griddata((Xs, Ys), signal, tuple(np.meshgrid(xAxis, yAxis)), method = method)
+        surface.flags.writeable = False
+        return {'surface': surface, 'grid': np.ma.masked_invalid(surface), 'xAxis': xAxis, 'yAxis': yAxis}
+
+    key = ('scattered', _scanHash(Xs, Ys, signal), resolution, method)
+    theDictionary = dict(_cached(key, compute))
+    theDictionary['key'] = key
+    return theDictionary
+
+
+def gridSurface(gridData, plane = 0, resolution = 200, method = 'cubic'):
+    '''
+    gridSurface interpolates one plane of a gridBuild grid (rectangular scans) onto a finer resolution x resolution grid over the
+    measured point centres, so the map can be drawn smoothly and evaluated between measurement points.
+        'cubic' a bicubic spline through the grid (RectBivariateSpline); unmeasured cells are filled from their nearest neighbour
+                for the fit, and the surface near them is masked again
+        'rbf'   a thin-plate-spline radial basis function through the measured points only (RBFInterpolator, local neighbourhoods)
+    Like nuSurface, the result is cached by the content of the plane and the parameters.
+    Returns a dictionary with the 'surface' (rows follow yAxis), its 'xAxis' and 'yAxis' [cm], the masked 'grid' and the cache 'key'.
+    '''
+    grid = np.ma.asarray(gridData['grid'])
+    grid = grid[plane] if grid.ndim == 3 else grid
+    values = grid.filled(np.nan).astype(np.float64)
+    measured = np.isfinite(values)
+    xAxis = np.asarray(gridData['xAxis'], dtype = np.float64)
+    yAxis = np.asarray(gridData['yAxis'], dtype = np.float64)
+    if method not in ('cubic', 'rbf'):
+        raise ValueError("method must be 'cubic' or 'rbf', not " + repr(method))
+    if not measured.any():
+        raise ValueError('The plane contains no measurement points.')
+
+    def compute():
+        xFine = np.linspace(xAxis[0], xAxis[-1], resolution)
+        yFine = np.linspace(yAxis[0], yAxis[-1], resolution)
+        X, Y = np.meshgrid(xAxis, yAxis)
+        if method == 'cubic':
+            filled = values
+            if not measured.all():
+                filled = griddata((X[measured], Y[measured]), values[measured], (X, Y), method = 'nearest')
+            spline = RectBivariateSpline(yAxis, xAxis, filled, kx = min(3, len(yAxis) - 1), ky = min(3, len(xAxis) - 1))
+            surface = spline(yFine, xFine)
+            # Mask the fine points whose nearest measurement cell was never measured.
+            nearestRow = np.rint(np.interp(yFine, yAxis, np.arange(len(yAxis)))).astype(int)
+            nearestColumn = np.rint(np.interp(xFine, xAxis, np.arange(len(xAxis)))).astype(int)
+            surface[~measured[np.ix_(nearestRow, nearestColumn)]] = np.nan
+        else:
+            rbf = RBFInterpolator(np.column_stack((X[measured], Y[measured])), values[measured], kernel = 'thin_plate_spline',
+                                  neighbors = min(64, int(measured.sum())))
+            XFine, YFine = np.meshgrid(xFine, yFine)
+            surface = rbf(np.column_stack((XFine.ravel(), YFine.ravel()))).reshape(XFine.shape)
+        surface.flags.writeable = False
+        return {'surface': surface, 'grid': np.ma.masked_invalid(surface), 'xAxis': xFine, 'yAxis': yFine}
+
+    key = ('grid', _scanHash(values, xAxis, yAxis), resolution, method)
+    theDictionary = dict(_cached(key, compute))
+    theDictionary['key'] = key
+    return theDictionary
+
+
+def surfaceIndex(surfaceData):
+    '''
+    surfaceIndex returns the nuIndex of an interpolated surface from gridSurface or nuSurface, built once and then served from the cache,
+    so nuQuery and nuBestWindow can be asked about the smooth map (e.g. sub-areas that do not line up with the measurement grid).
+    '''
+    return _cached(surfaceData['key'] + ('index',), lambda: nuIndex(surfaceData))
+
+
+def apertureKernel(detArea, xStep, yStep, supersample = 8):
+    '''
+    apertureKernel returns the averaging kernel of a round detector of detArea cm^2 sampled on a grid with xStep x yStep cm spacing.
+    Each kernel cell holds the fraction of the detector face it covers (from supersample x supersample sub-points per cell), normalized to sum to 1.
+    '''
+    radius = np.sqrt(float(detArea) / np.pi)
+    halfX = int(np.ceil(radius / xStep - 0.5))
+    halfY = int(np.ceil(radius / yStep - 0.5))
+    offsets = (np.arange(supersample) + 0.5) / supersample - 0.5
+    xs = (np.arange(-halfX, halfX + 1)[:, None] + offsets).ravel() * xStep
+    ys = (np.arange(-halfY, halfY + 1)[:, None] + offsets).ravel() * yStep
+    inside = (xs[None, :] ** 2 + ys[:, None] ** 2) <= radius ** 2
+    kernel = inside.reshape(2 * halfY + 1, supersample, 2 * halfX + 1, supersample).sum(axis = (1, 3)).astype(np.float64)
+    return kernel / kernel.sum()
+
+
+def nuDeconvolve(gridData, detArea, plane = 0, method = 'wiener', balance = 1e-2, iterations = 30):
+    '''
+    nuDeconvolve removes the averaging of the detector aperture from one plane of a gridded NU map, so hot spots smaller than the
+    detector are no longer smeared out. The aperture is a round detector of detArea cm^2 (see apertureKernel).
+        'wiener'          one regularized inverse filter, G * conj(H) / (|H|^2 + balance), scaled by (1 + balance) so the mean level is kept;
+                          a larger balance suppresses more noise
+        'richardson-lucy' `iterations` multiplicative updates, which keep the map positive and need no balance
+    The plane is padded by at least the kernel size (mirrored at the edges, so the border is not wrapped around) up to a fast FFT length, and
+    all convolutions use real-valued transforms (scipy.fft.rfft2), so memory stays a small multiple of the grid size.
+    Unmeasured cells are filled from their nearest neighbour for the transform and masked again afterwards.
+    Only detail down to the grid spacing can be recovered: a detector smaller than one grid step leaves the map unchanged.
+    Returns a dictionary with the corrected masked 'grid', 'xAxis', 'yAxis', the 'kernel', and the 'rawNU' and corrected 'NU' [%].
+    '''
+    grid = np.ma.asarray(gridData['grid'])
+    grid = grid[plane] if grid.ndim == 3 else grid
+    values = grid.filled(np.nan).astype(np.float64)
+    measured = np.isfinite(values)
+    xAxis = np.asarray(gridData['xAxis'], dtype = np.float64)
+    yAxis = np.asarray(gridData['yAxis'], dtype = np.float64)
+    if not measured.any():
+        raise ValueError('The plane contains no measurement points.')
+    if method not in ('wiener', 'richardson-lucy'):
+        raise ValueError("method must be 'wiener' or 'richardson-lucy', not " + repr(method))
+
+    if not measured.all():
+        X, Y = np.meshgrid(xAxis, yAxis)
+        values = griddata((X[measured], Y[measured]), values[measured], (X, Y), method = 'nearest')
+    # Work on positive readings whatever the sign convention of the detector current.
+    sign = 1.0 if values.mean() >= 0 else -1.0
+    values = sign * values
+
+    xStep = np.diff(xAxis).min() if len(xAxis) > 1 else 1.0
+    yStep = np.diff(yAxis).min() if len(yAxis) > 1 else 1.0
+    kernel = apertureKernel(detArea, xStep, yStep)
+    padY, padX = kernel.shape[0], kernel.shape[1]
+    shape = (sfft.next_fast_len(values.shape[0] + 2 * padY, real = True), sfft.next_fast_len(values.shape[1] + 2 * padX, real = True))
+    padded = np.pad(values, ((padY, shape[0] - values.shape[0] - padY), (padX, shape[1] - values.shape[1] - padX)), mode = 'symmetric')
+
+    # Transfer function of the kernel, centred on the origin so the result is not shifted.
+    centred = np.zeros(shape)
+    centred[:kernel.shape[0], :kernel.shape[1]] = kernel
+    centred = np.roll(centred, (-(kernel.shape[0] // 2), -(kernel.shape[1] // 2)), axis = (0, 1))
+    H = sfft.rfft2(centred, workers = -1)
+    del centred
+
+    def convolve(image, transfer):
+        return sfft.irfft2(sfft.rfft2(image, workers = -1) * transfer, s = shape, workers = -1)
+
+    if method == 'wiener':
+        restored = convolve(padded, (1 + balance) * np.conj(H) / (np.abs(H) ** 2 + balance))
+    else:
+        if (padded <= 0).any():
+            raise ValueError('Richardson-Lucy deconvolution needs readings of a single sign.')
+        restored = padded.copy()
+        for _ in range(iterations):
+            blurred = convolve(restored, H)
+            restored *= convolve(padded / np.maximum(blurred, 1e-12 * padded.max()), np.conj(H))
+
+    restored = sign * restored[padY:padY + values.shape[0], padX:padX + values.shape[1]]
+    corrected = np.ma.masked_array(restored, mask = ~measured)
+    raw = values[measured]
+
+    theDictionary = {
+        'grid': corrected,
+        'xAxis': xAxis,
+        'yAxis': yAxis,
+        'kernel': kernel,
+        'rawNU': nonUniformity(raw.max(), raw.min()),
+        'NU': nonUniformity(corrected.max(), corrected.min()),
+    }
+    return theDictionary
+
+
+def nuMosaic(tiles, decimals = 4):
+    '''
+    nuMosaic assembles overlapping rectangular scan tiles into one gridded map. tiles is a list of dictionaries with 'Xs', 'Ys', 'Zs' and
+    'signal' in absolute stage coordinates (e.g. sudatImport results); positions are matched after rounding to `decimals` places [cm].
+    Each tile is allowed its own gain (lamp drift, detector re-seating between tiles): the log readings are fitted as
+    log gain[tile] + log irradiance[cell] by least squares, with the cells reduced out of the normal equations through sparse
+    point-to-tile and point-to-cell incidence matrices, leaving a tiles x tiles system. Gains have a geometric mean of 1 per group of
+    overlapping tiles; tiles that overlap no other tile keep a gain of 1 (with a message). Overlapping readings are then averaged.
+    Returns a gridBuild-style dictionary ('grid', 'xAxis', 'yAxis', 'zAxis') plus the tile 'gains', the number of 'overlapCells', and the
+    RMS mismatch [%] of the overlapping readings from their cell mean before ('mismatchRaw') and after ('mismatch') gain matching.
+    '''
+    sizes = [len(tile['signal']) for tile in tiles]
+    tileIndex = np.repeat(np.arange(len(tiles)), sizes)
+    signal = np.concatenate([np.asarray(tile['signal'], dtype = np.float64) for tile in tiles])
+    xAxis, xIndex = _axisIndex(np.concatenate([np.asarray(tile['Xs'], dtype = np.float64) for tile in tiles]), decimals)
+    yAxis, yIndex = _axisIndex(np.concatenate([np.asarray(tile['Ys'], dtype = np.float64) for tile in tiles]), decimals)
+    zAxis, zIndex = _axisIndex(np.concatenate([np.asarray(tile['Zs'], dtype = np.float64) for tile in tiles]), decimals)
+
+    valid = np.isfinite(signal)
+    tileIndex, signal, xIndex, yIndex, zIndex = tileIndex[valid], signal[valid], xIndex[valid], yIndex[valid], zIndex[valid]
+    # Work on positive readings whatever the sign convention of the detector current.
+    sign = 1.0 if signal.mean() >= 0 else -1.0
+    if (sign * signal <= 0).any():
+        raise ValueError('Gain matching needs readings of a single sign.')
+    logSignal = np.log(sign * signal)
+
+    cellIndex = np.ravel_multi_index((zIndex, yIndex, xIndex), (len(zAxis), len(yAxis), len(xAxis)))
+    cells, cellIndex = np.unique(cellIndex, return_inverse = True)
+    points, tileCount, cellCount = len(signal), len(tiles), len(cells)
+    P = sparse.csr_matrix((np.ones(points), (np.arange(points), tileIndex)), shape = (points, tileCount))
+    C = sparse.csr_matrix((np.ones(points), (np.arange(points), cellIndex)), shape = (points, cellCount))
+    perCell = np.asarray(C.sum(axis = 0)).ravel()
+    overlap = perCell[cellIndex] > 1
+
+    # Normal equations with the cell terms eliminated: (P'P - P'C N^-1 C'P) a = P'y - P'C N^-1 C'y.
+    PC = (P.T @ C).tocsr()
+    weighted = PC @ sparse.diags(1 / perCell)
+    laplacian = (P.T @ P - weighted @ PC.T).toarray()
+    rhs = P.T @ logSignal - weighted @ (C.T @ logSignal)
+    # The minimum-norm solution has a zero mean log gain within each group of connected tiles.
+    logGains = np.linalg.lstsq(laplacian, rhs, rcond = None)[0]
+
+    groups, label = connected_components(sparse.csr_matrix(PC @ PC.T), directed = False)
+    if groups > 1:
+        alone = [str(tile) for tile in range(tileCount) if np.sum(label == label[tile]) == 1]
+        print('The tiles form ' + str(groups) + ' groups that do not overlap each other; their levels are not matched to each other.'
+              + (' Tiles without any overlap: ' + ', '.join(alone) + '.' if alone else ''))
+    gains = np.exp(logGains)
+
+    def mismatch(values):
+        cellMean = np.bincount(cellIndex, values, minlength = cellCount) / perCell
+        return 100 * np.sqrt(np.mean((values[overlap] / cellMean[cellIndex[overlap]] - 1) ** 2)) if overlap.any() else 0.0
+
+    corrected = signal / gains[tileIndex]
+    grid = np.full(len(zAxis) * len(yAxis) * len(xAxis), np.nan)
+    grid[cells] = np.bincount(cellIndex, corrected, minlength = cellCount) / perCell
+
+    theDictionary = {
+        'grid': np.ma.masked_invalid(grid.reshape(len(zAxis), len(yAxis), len(xAxis))),
+        'xAxis': xAxis,
+        'yAxis': yAxis,
+        'zAxis': zAxis,
+        'gains': gains,
+        'overlapCells': int(np.sum(perCell > 1)),
+        'mismatchRaw': mismatch(sign * signal),
+        'mismatch': mismatch(sign * corrected),
+    }
+    return theDictionary
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide store for the reference files in required_files (solar standards, transfer functions).
+Each file is parsed once per process into read-only NumPy arrays, and can be persisted as a memory-mapped
+.npy sidecar so other processes (batch workers, other Streamlit servers) map the same data instead of re-parsing the CSV.
+"""
+import os
+import glob
+import hashlib
+import numpy as np
+import pandas as pd
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'required_files')
+CACHE_DIR_NAME = '.cache'   # sidecars live in this folder next to their source file
+
+REFERENCE_PATH = os.path.join(FILES_DIR, 'Solar_Standards.csv')
+REFERENCE_NAMES = ['Wavelengths', 'AM0 Irrad', 'AM1.5G Irrad', 'AM1.5D Irrad', 'AM0 Rad', 'AM1.5G Rad', 'AM1.5D Rad']
+TRANSFER_NAMES = ['tWaves', 'tdata']
+
+_cache = {}
+
+
+def _fileHash(path):
+    '''
+    Returns the SHA-1 hex digest of a file's contents.
+    '''
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def _sidecarPath(path, digest):
+    '''
+    Returns the sidecar location for a source file. The content hash is part of the name, so an edited source never matches a stale sidecar.
+    '''
+    return os.path.join(os.path.dirname(path), CACHE_DIR_NAME, os.path.basename(path) + '.' + digest[:16] + '.npy')
+
+
+def _sidecarLoad(path, digest):
+    '''
+    Memory-maps the sidecar for this version of the file, or returns None if there is none (or it cannot be read).
+    '''
+    try:
+        return np.load(_sidecarPath(path, digest), mmap_mode = 'r')
+    except (OSError, ValueError):
+        return None
+
+
+def _sidecarWrite(path, digest, values):
+    '''
+    Writes the parsed table as a sidecar and removes sidecars left over from older versions of the file.
+    The write goes through a temporary file and an atomic rename so concurrent workers never see a partial sidecar.
+    Failures (e.g. a read-only share) are ignored; the in-memory copy is still used.
+    '''
+    sidecar = _sidecarPath(path, digest)
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok = True)
+        for stale in glob.glob(glob.escape(os.path.join(os.path.dirname(sidecar), os.path.basename(path))) + '.*.npy'):
+            if stale != sidecar:
+                os.remove(stale)
+        temporary = sidecar + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'wb') as file:
+            np.save(file, values)
+        os.replace(temporary, sidecar)
+    except OSError:
+        pass
+
+
+def referenceTable(path, names, header = None, sidecar = True):
+    '''
+    referenceTable returns the numeric CSV at `path` as a dictionary of read-only float64 column arrays keyed by `names`.
+    header is passed to pandas (None for headerless files, 0 if the first row is a header that `names` replaces).
+    The parsed table is kept for the life of the process and reloaded only if the file's modification time changes and its content hash differs.
+    With sidecar = True the table is also stored as a memory-mapped .npy file in a .cache folder beside the source.
+    '''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    entry = _cache.get(path)
+    if entry is not None and entry['stamp'] == (stat.st_mtime_ns, stat.st_size):
+        return dict(zip(names, entry['values']))
+
+    digest = _fileHash(path)
+    if entry is not None and entry['hash'] == digest:
+        # The file was touched but not changed.
+        entry['stamp'] = (stat.st_mtime_ns, stat.st_size)
+        return dict(zip(names, entry['values']))
+
+    values = _sidecarLoad(path, digest) if sidecar else None
+    if values is None:
+        # Store the table column by column so each column is one contiguous block.
+        values = np.ascontiguousarray(pd.read_csv(path, header = header, names = names).to_numpy(dtype = np.float64).T)
+        values.flags.writeable = False
+        if sidecar:
+            _sidecarWrite(path, digest, values)
+
+    _cache[path] = {
+        'stamp': (stat.st_mtime_ns, stat.st_size),
+        'hash': digest,
+        'values': values,
+    }
+    return dict(zip(names, values))
+
+
+def transferFunction(path, sidecar = True):
+    '''
+    transferFunction returns a detector transfer function file (e.g. Transfer-Si-HI.csv) as {'tWaves': ..., 'tdata': ...}.
+    path can be a full path or a file name inside required_files.
+    '''
+    if not os.path.dirname(path):
+        path = os.path.join(FILES_DIR, path)
+    return referenceTable(path, TRANSFER_NAMES, sidecar = sidecar)
@@ -4,6 +4,8 @@ import os
 from io import StringIO
 from tkinter import filedialog
 from .Conversions import conv2Irrad
+from .ImageNU import imageOpen, imageNU
+from .NUAnalysis import nuMosaic, nonUniformity
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -70,6 +72,9 @@ def ivdatImports(uploaded_files):
                                  header=headerRows + numberOfData + 2,
                                  skipfooter=1, names=('Parameters', 'Values'), engine='python')
 
+        # Timing parameters by name; their position depends on which optional header lines the instrument wrote.
+        headerValues = dict(zip(headerData['Parameters'].astype(str).str.strip().str.rstrip(':'), headerData['Values']))
+
         # --- Structure file-specific dictionary ---
         tempD = {
             'voltage': voltage,
@@ -79,9 +84,9 @@ def ivdatImports(uploaded_files):
             'date': headerData['Values'][1],
             'detArea': headerData['Values'][6],
             'numPoints': headerData['Values'][10],
-            'spp': headerData['Values'][11],
-            'wait': headerData['Values'][12],
-            'dwell': headerData['Values'][13],
+            'spp': headerValues.get('NumberOfSamplesPerPoint'),
+            'wait': headerValues.get('WaitSeconds'),
+            'dwell': headerValues.get('DwellSeconds'),
             'Voc': footerData['Values'][0],
             'Isc': footerData['Values'][1],
             'maxP': footerData['Values'][2],
@@ -92,38 +97,93 @@ def ivdatImports(uploaded_files):
 
     return theDictionary
 
+def _sectionValues(sectionText):
+    '''
+    Reads the "Parameter:<tab>"Value"" lines of a header or footer block into a dictionary keyed by parameter name.
+    '''
+    values = {}
+    for line in sectionText.split('\n'):
+        key, sep, value = line.partition('\t')
+        key = key.strip()
+        if not sep or key.startswith('START') or key.startswith('END'):
+            continue
+        values[key.rstrip(':')] = value.strip().strip('"')
+    return values
+
+
+def sciFileParse(content):
+    '''
+    sciFileParse reads the text of a Sci data file (.sidat, .ssdat, .sudat, .ivdat) in a single pass.
+    content can be the raw bytes of the upload or the decoded text.
+    Returns a dictionary with:
+        'header'  - {parameter name: value string} from the START HEADER block
+        'columns' - the data column names, in file order
+        'data'    - {column name: float64 NumPy array} from the START DATA block
+        'footer'  - {parameter name: value string} from the START FOOTER block (empty if the file has none)
+    A missing END DATA marker is tolerated so partially written files can still be read.
+    '''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    content = content.replace('\r\n', '\n')
+
+    dataStart = content.find('START DATA')
+    if dataStart < 0:
+        raise ValueError("Could not find 'START DATA' marker in file.")
+    dataEnd = content.find('END DATA', dataStart)
+    if dataEnd < 0:
+        dataEnd = len(content)
+
+    # The data block is the format line, the column names, then tab-separated numeric rows.
+    _, _, block = content[dataStart:dataEnd].partition('\n')
+    namesLine, _, block = block.partition('\n')
+    columns = [name.strip() for name in namesLine.split('\t')]
+
+    # Drop a trailing partial row (file still being written) before handing the block to NumPy.
+    if block and not block.endswith('\n'):
+        block = block[:block.rfind('\n') + 1]
+    if block.strip():
+        values = np.loadtxt(StringIO(block), delimiter = '\t', dtype = np.float64, ndmin = 2)
+    else:
+        values = np.empty((0, len(columns)), dtype = np.float64)
+    if values.shape[1] != len(columns):
+        raise ValueError('Data block has ' + str(values.shape[1]) + ' columns but ' + str(len(columns)) + ' column names.')
+    values = np.ascontiguousarray(values.T)
+
+    theDictionary = {
+        'header': _sectionValues(content[:dataStart]),
+        'columns': columns,
+        'data': dict(zip(columns, values)),
+        'footer': _sectionValues(content[dataEnd:]),
+    }
+    return theDictionary
+
+
+def fileContents(files):
+    '''
+    fileContents returns [(file name, raw bytes), ...] for a list of uploaded file objects (anything with .name and .getvalue() or .read()) or paths.
+    The bytes can be sent to worker processes, which the upload objects themselves cannot.
+    '''
+    contents = []
+    for file in files:
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'rb') as handle:
+                contents.append((os.path.basename(file), handle.read()))
+        else:
+            contents.append((file.name, file.getvalue() if hasattr(file, 'getvalue') else file.read()))
+    return contents
+
+
 def ssdatImport(uploaded_file):
     if uploaded_file is None:
         print('No file was uploaded.')
         return None
 
-    # Decode entire file and split into lines
-    file_lines = uploaded_file.getvalue().decode('utf-8').splitlines()
-
-    # Find header row for data
-    for hLineNo, hLine in enumerate(file_lines):
-        # print(hLine)
-        if hLine.startswith('Wavelength'):
-            headerRows = hLineNo - 1
-            print(headerRows)
-            break
-    else:
+    parsed = sciFileParse(uploaded_file.getvalue())
+    header = parsed['header']
+    fileData = parsed['data']
+    if 'Wavelength(nm)' not in fileData:
         raise ValueError("Could not find 'Wavelength' header in file.")
 
-    # Read data section
-    file_str = '\n'.join(file_lines)
-    file_io = StringIO(file_str)
-    fileData = pd.read_csv(file_io, sep='\t', header=headerRows, skipfooter=1, engine='python')
-
-    numberOfData = len(fileData['Wavelength(nm)'])
-
-    # Rewind to read header section
-    file_io.seek(0)
-    headerData = pd.read_csv(file_io, sep='\t', header=0,
-                             skipfooter=numberOfData + 4,
-                             names=('Parameters', 'Values'),
-                             engine='python')
-
     # Build the dictionary to return
     theDictionary = {
         'wavelengths': fileData['Wavelength(nm)'],
@@ -132,12 +192,14 @@ def ssdatImport(uploaded_file):
         'gIndices': fileData['Grating Index(#)'],
         'fIndices': fileData['Filter Index(#)'],
         'filepath': uploaded_file.name,   # Just the filename, no full path
-        'filename': headerData['Values'][0],
-        'date': headerData['Values'][1],
-        'monoModel': headerData['Values'][5],
-        'startWave': headerData['Values'][7],
-        'stopWave': headerData['Values'][8],
-        'stepSize': headerData['Values'][9],
+        'filename': header.get('FileName'),
+        'date': header.get('Date'),
+        'monoModel': header.get('MonoInfo'),
+        'startWave': header.get('StartingWavelength'),
+        'stopWave': header.get('StoppingWavelength'),
+        'stepSize': header.get('StepSize'),
+        'header': header,
+        'footer': parsed['footer'],
     }
 
     print(theDictionary['filename'] + ' has been successfully imported.')
@@ -149,33 +211,12 @@ def sidatImport(uploaded_file):
         print('No file was uploaded.')
         return None
 
-    # Decode entire file and split into lines
-    file_lines = uploaded_file.getvalue().decode('utf-8').splitlines()
-
-    # Find header row for data
-    for hLineNo, hLine in enumerate(file_lines):
-        # print(hLine)
-        if hLine.startswith('Wavelength'):
-            headerRows = hLineNo - 1
-            print(headerRows)
-            break
-    else:
+    parsed = sciFileParse(uploaded_file.getvalue())
+    header = parsed['header']
+    fileData = parsed['data']
+    if 'Wavelength(nm)' not in fileData:
         raise ValueError("Could not find 'Wavelength' header in file.")
 
-    # Read data section
-    file_str = '\n'.join(file_lines)
-    file_io = StringIO(file_str)
-    fileData = pd.read_csv(file_io, sep='\t', header=headerRows, skipfooter=1, engine='python')
-
-    numberOfData = len(fileData['Wavelength(nm)'])
-
-    # Rewind to read header section
-    file_io.seek(0)
-    headerData = pd.read_csv(file_io, sep='\t', header=0,
-                             skipfooter=numberOfData + 4,
-                             names=('Parameters', 'Values'),
-                             engine='python')
-
     # Build the dictionary to return
     theDictionary = {
         'test' : 'test',
@@ -187,12 +228,14 @@ def sidatImport(uploaded_file):
         'gIndices': fileData['GratingIndex(#)'],
         'fIndices': fileData['FilterIndex(#)'],
         'filepath': uploaded_file.name,   # Just the filename, no full path
-        'filename': headerData['Values'][0],
-        'date': headerData['Values'][1],
-        'monoModel': headerData['Values'][5],
-        'startWave': headerData['Values'][8],
-        'stopWave': headerData['Values'][9],
-        'stepSize': headerData['Values'][10],
+        'filename': header.get('FileName'),
+        'date': header.get('Date'),
+        'monoModel': header.get('MonoInfo'),
+        'startWave': header.get('StartWavelength'),
+        'stopWave': header.get('StopWavelength'),
+        'stepSize': header.get('StepSize'),
+        'header': header,
+        'footer': parsed['footer'],
     }
 
     print(theDictionary['filename'] + ' has been successfully imported.')
@@ -290,3 +333,114 @@ def sudatImport(uploaded_file):
     print(theDictionary['filename'] + ' has been successfully imported.')
     return theDictionary
 
+
+
+def imageImport(source, pixelSize, detArea, dark = None, flat = None, roi = None, shape = None, dtype = None, offset = 0):
+    '''
+    imageImport reads a camera image of the target plane (.npy, .tif, .png or raw .raw/.bin, see imageOpen) and bins it into square cells
+    of the detector area detArea [cm^2] with imageNU, after dark and flat-field correction. dark and flat can be frames (arrays, paths or
+    uploads) or, for dark, a constant level. pixelSize is the size of one pixel on the target plane [cm].
+    Returns a dictionary laid out like a rectangular sudatImport result, one point per cell, so it can be passed to NUScript.
+    '''
+    if source is None:
+        print('No file was uploaded.')
+        return None
+
+    def opened(frame):
+        if frame is None or isinstance(frame, (int, float, np.number, np.ndarray)):
+            return frame
+        return imageOpen(frame, shape, dtype, offset)
+
+    name = os.path.basename(os.fspath(source)) if isinstance(source, (str, os.PathLike)) else source.name
+    cells = imageNU(opened(source), pixelSize, math.sqrt(float(detArea)), opened(dark), opened(flat), roi)
+    X, Y = np.meshgrid(cells['xAxis'], cells['yAxis'])
+    signal = pd.Series(cells['grid'][0].filled(np.nan).ravel())
+    step = cells['xAxis'][1] - cells['xAxis'][0] if len(cells['xAxis']) > 1 else cells['binning'] * pixelSize
+
+    theDictionary = {
+        'Xs': pd.Series(X.ravel()),
+        'Ys': pd.Series(Y.ravel()),
+        'Zs': pd.Series(np.full(X.size, np.nan)),
+        'signal': signal,
+        'calSignal': signal,
+        'filename': name,
+        'date': pd.Timestamp(os.path.getmtime(source), unit = 's').strftime('%Y-%m-%d') if isinstance(source, (str, os.PathLike)) else None,
+        'geometry': 'Rectangular',
+        'xSize': len(cells['xAxis']) * step,
+        'ySize': len(cells['yAxis']) * step,
+        'zSize': 0,
+        'xSpacing': step,
+        'ySpacing': step,
+        'zSpacing': 0,
+        'xNum': len(cells['xAxis']),
+        'yNum': len(cells['yAxis']),
+        'zNum': 1,
+        'detArea': detArea,
+        'NU': cells['NU'],
+        'minSignal': cells['min'],
+        'maxSignal': cells['max'],
+        'pixelNU': cells['pixelNU'],
+        'binning': cells['binning'],
+    }
+
+    print(theDictionary['filename'] + ' has been successfully imported.')
+    return theDictionary
+
+
+def mosaicImport(uploaded_files, decimals = 4):
+    '''
+    mosaicImport reads several overlapping rectangular .sudat tiles of one target area and assembles them into a single map with
+    nuMosaic (tiles aligned by their absolute X/Y positions, gains matched on the overlaps, overlapping readings averaged).
+    Returns a dictionary laid out like a rectangular sudatImport result, one point per grid position, so it can be passed to NUScript,
+    with the tile 'gains' and the overlap 'mismatch' [%] before and after gain matching added.
+    '''
+    tiles = []
+    for uploaded_file in uploaded_files:
+        tile = sudatImport(uploaded_file)
+        if tile is None or tile['geometry'] != 'Rectangular':
+            print('The following datafile is not a rectangular scan and will be ignored: ' + str(getattr(uploaded_file, 'name', uploaded_file)))
+            continue
+        tiles.append(tile)
+    if not tiles:
+        print('No tiles could be imported.')
+        return None
+
+    mosaic = nuMosaic(tiles, decimals)
+    grid = mosaic['grid']
+    Z, Y, X = np.meshgrid(mosaic['zAxis'], mosaic['yAxis'], mosaic['xAxis'], indexing = 'ij')
+    measured = ~np.ma.getmaskarray(grid)
+    signal = pd.Series(grid.data[measured])
+    # Planes without a Z column come back as 0 from the grid; restore the NaN single-plane convention.
+    zs = Z[measured] if np.isfinite(np.concatenate([np.asarray(tile['Zs'], dtype = np.float64) for tile in tiles])).any() else np.full(measured.sum(), np.nan)
+
+    theDictionary = {
+        'Xs': pd.Series(X[measured]),
+        'Ys': pd.Series(Y[measured]),
+        'Zs': pd.Series(zs),
+        'signal': signal,
+        'calSignal': signal,
+        'filename': ', '.join(tile['filename'] for tile in tiles),
+        'date': tiles[0]['date'],
+        'geometry': 'Rectangular',
+        'xSize': mosaic['xAxis'][-1] - mosaic['xAxis'][0] + float(tiles[0]['xSpacing']),
+        'ySize': mosaic['yAxis'][-1] - mosaic['yAxis'][0] + float(tiles[0]['ySpacing']),
+        'zSize': tiles[0]['zSize'],
+        'xSpacing': tiles[0]['xSpacing'],
+        'ySpacing': tiles[0]['ySpacing'],
+        'zSpacing': tiles[0]['zSpacing'],
+        'xNum': len(mosaic['xAxis']),
+        'yNum': len(mosaic['yAxis']),
+        'zNum': len(mosaic['zAxis']),
+        'detArea': tiles[0]['detArea'],
+        'NU': nonUniformity(signal.max(), signal.min()),
+        'minSignal': signal.min(),
+        'maxSignal': signal.max(),
+        'gains': mosaic['gains'],
+        'overlapCells': mosaic['overlapCells'],
+        'mismatchRaw': mosaic['mismatchRaw'],
+        'mismatch': mosaic['mismatch'],
+    }
+
+    print(str(len(tiles)) + ' tiles have been assembled into one map (overlap mismatch ' + '%.3f' % mosaic['mismatchRaw'] + ' % before and '
+          + '%.3f' % mosaic['mismatch'] + ' % after gain matching).')
+    return theDictionary
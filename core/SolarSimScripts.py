@@ -6,20 +6,67 @@ import statistics
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 import matplotlib.cm as cm
 import matplotlib.colors as mcolors
+from matplotlib.collections import EllipseCollection
 from . import SciImports as ScImp
 from scipy import interpolate
 from tabulate import tabulate
-from .Conversions import conv2Irrad
+from .Conversions import conv2Irrad, stitchSpectra
+from .Decimation import decimate
+from .NUAnalysis import gridBuild, nuIndex, nuBestWindow, pointIndex, classDiameters, nuSurface, gridSurface, surfaceIndex, nuPlanes, pointPlanes, workingDistance, nuDeconvolve, nuClass
+from .ReferenceData import transferFunction
+from .SpectralDeviation import spdSpc
+from .SpectralMatch import standardsLoad, binClassify, referenceLoad, sidatSpectrum, classifyAll, classifyAllFrame
+from .TIAnalysis import MIN_POINTS, instability, tiStats, tiBatch, tiTable, pointTiming, flickerSpectrum
 
 
-def NUScript(nuData):
+def _planesReport(report_d, planes):
+    '''
+    Adds the multi-plane results (NU per z plane and the recommended working position) to an NU report and saves the NU vs z plot.
+    '''
+    best = workingDistance(planes['z'], planes['NU'])
+    plt.plot(best['curveZ'], best['curveNU'], color = 'tab:green')
+    plt.plot(planes['z'], planes['NU'], 'o', color = 'tab:green')
+    plt.axvline(best['z'], color = 'grey', linestyle = '--')
+    plt.title('Non-Uniformity vs. Z Position')
+    plt.xlabel('Z Position [cm]')
+    plt.ylabel('Spatial Non-Uniformity [%]')
+    plt.savefig("output/NUplanes.png")
+    plt.clf()
+
+    report_d['Number of Z Planes'] = len(planes['z'])
+    report_d['Non-Uniformity per Z Plane [%]'] = dict(zip(planes['z'].tolist(), planes['NU'].tolist()))
+    report_d['Best Measured Z Plane [cm]'] = planes['z'][best['plane']]
+    report_d['Recommended Z Position [cm]'] = best['z']
+    report_d['Expected Non-Uniformity at Recommended Z [%]'] = best['NU']
+    return report_d
+
+
+def _correctedReport(report_d, corrected, method):
+    '''
+    Adds the measured and aperture-corrected NU from nuDeconvolve to an NU report.
+    '''
+    report_d['Aperture Correction Method'] = method
+    report_d['Spatial Non-Uniformity, Measured Map [%]'] = corrected['rawNU']
+    report_d['Spatial Non-Uniformity, Aperture Corrected [%]'] = corrected['NU']
+    report_d['Aperture Corrected Class'] = nuClass(corrected['NU'])
+    return report_d
+
+
+def NUScript(nuData, subAreas = None, surface = False, deconvolve = None):
     '''
     This function takes a single .sudat file as input, calculates its spatial non-uniformity, then outputs the results along with a plot for the test report.
     It can be used for rectangular or circular data and will output raw and normalized plots for a given dataset.
     Note that the normalization assumes that the target illumination level is 1 Sun.
+    subAreas is an optional list of sub-area sizes in cm (a number for a square, or a (width, height) pair). For rectangular scans the
+    best-placed window of each size, with its NU and class, is added to the report.
+    surface = True draws the map as a smooth interpolated surface (bicubic for rectangular scans, scattered-data for circular ones) instead of
+    measurement cells or detector footprints; for rectangular scans the best sub-areas are then also searched on that surface.
+    deconvolve = 'wiener' or 'richardson-lucy' removes the averaging over the detector area from the map (see nuDeconvolve; circular scans
+    are deconvolved on their interpolated surface) and reports the aperture-corrected NU next to the measured one.
+    For scans with several z planes the map and the main figures are those of the first (lowest) plane. Every plane is analyzed as well:
+    the NU (and best sub-areas) of each plane and the z position with the lowest NU are added to the report, with an NU vs z plot.
     '''
     # Import the NU scan data
     # nuData = ScImp.sudatImport('Select the desired .sudat file.')
@@ -28,19 +75,23 @@ def NUScript(nuData):
     geo = nuData['geometry']
     
     if geo == 'Rectangular':
-        # Order the signal data into an array
-        blockData = []
-        for y in range(int(nuData['yNum'])):
-            dataRow = []
-            for x in range(int(nuData['xNum'])):
-                dataRow.append(nuData['signal'][y * int(nuData['xNum']) + x] * 1000)    # x1000 to convert to mA
-            blockData.append(dataRow)
+        # Order the signal data into a (z, y, x) grid. Only the first plane is used for the report.
+        gridData = gridBuild(nuData['Xs'], nuData['Ys'], nuData['Zs'], nuData['signal'])
+        blockData = gridData['grid'][0] * 1000    # x1000 to convert to mA
+        xStep = np.diff(gridData['xAxis']).min() if len(gridData['xAxis']) > 1 else float(nuData['xSpacing'])
+        yStep = np.diff(gridData['yAxis']).min() if len(gridData['yAxis']) > 1 else float(nuData['ySpacing'])
         
         # Generate a plot with normalized values
         blockData = np.flip(blockData, 0)   # reverse the data so it displays in the correct order
         normArray = blockData / max(blockData.min(), blockData.max(), key = abs)        # normalize against the maximum detected current
         normArray = normArray * ((normArray.max() - normArray.min()) / 2) + normArray   # shift the dataset up such that it is centered around 1 Sun
-        normPlot = plt.imshow(normArray, interpolation = 'none', cmap = 'summer', vmin = normArray.min(), vmax = normArray.max(), extent = [0, abs(nuData['Xs'].min()) + abs(nuData['Xs'].max()) + float(nuData['xSpacing']), 0, abs(nuData['Ys'].min()) + abs(nuData['Ys'].max()) + float(nuData['ySpacing'])])
+        if surface:
+            # Smooth view: the (cached) bicubic surface of the normalized values, drawn over the point centres.
+            smooth = gridSurface({'grid': np.flip(normArray, 0), 'xAxis': gridData['xAxis'], 'yAxis': gridData['yAxis']})
+            normPlot = plt.imshow(smooth['surface'], origin = 'lower', cmap = 'summer', vmin = normArray.min(), vmax = normArray.max(),
+                                  extent = [xStep / 2, gridData['xAxis'][-1] - gridData['xAxis'][0] + xStep / 2, yStep / 2, gridData['yAxis'][-1] - gridData['yAxis'][0] + yStep / 2])
+        else:
+            normPlot = plt.imshow(normArray, interpolation = 'none', cmap = 'summer', vmin = normArray.min(), vmax = normArray.max(), extent = [0, gridData['xAxis'][-1] - gridData['xAxis'][0] + xStep, 0, gridData['yAxis'][-1] - gridData['yAxis'][0] + yStep])
         cbar = plt.colorbar(normPlot)
         cbar.set_label('Irradiance [Suns]')
         plt.title('Non-Uniformity Plot - Normalized')
@@ -61,14 +112,49 @@ def NUScript(nuData):
             'Standard Deviation [Suns]': np.std(normArray),
             'Spatial Non-Uniformity of Irradiance [%]': nuData['NU']
             }
+        
+        # Best-placed sub-areas of the requested sizes.
+        if subAreas:
+            index = nuIndex(gridData)
+            for size in subAreas:
+                width, height = (size, size) if np.isscalar(size) else size
+                label = 'Best ' + str(width) + ' x ' + str(height) + ' cm Sub-Area'
+                best = nuBestWindow(index, width, height)
+                report_d[label + ' NU [%]'] = best['NU']
+                report_d[label + ' Class'] = best['class']
+                report_d[label + ' Center [cm]'] = best['center']
+                if surface:
+                    # The same search on the interpolated surface, free of the measurement grid.
+                    best = nuBestWindow(surfaceIndex(smooth), width, height)
+                    report_d[label + ' NU (Interpolated) [%]'] = best['NU']
+                    report_d[label + ' Center (Interpolated) [cm]'] = best['center']
+
+        # Remove the smearing of the detector aperture.
+        if deconvolve:
+            corrected = nuDeconvolve(gridData, nuData['detArea'], method = deconvolve)
+            _correctedReport(report_d, corrected, deconvolve)
+
+        # Every z plane of the stack at once, and the z position with the lowest NU.
+        if len(gridData['zAxis']) > 1:
+            planes = nuPlanes(gridData, subAreas)
+            _planesReport(report_d, planes)
+            for (width, height), windows in planes['subAreas'].items():
+                report_d['Best ' + str(width) + ' x ' + str(height) + ' cm Sub-Area NU per Z Plane [%]'] = dict(zip(planes['z'].tolist(), windows['NU'].tolist()))
         resultsFrame = pd.DataFrame.from_dict(report_d, orient = 'index')
         # print(tabulate(resultsFrame, colalign = ('right',)))
     
     elif geo == 'Circular':
         detDiam = 2 * np.sqrt(float(nuData['detArea']) / np.pi)
         
+        # Only the first (lowest) z plane is used for the report, as for rectangular scans; pointPlanes covers the others.
+        zs = pd.Series(nuData['Zs'], dtype = float).round(4).to_numpy()
+        onPlane = (zs == np.nanmin(zs)) if np.isfinite(zs).any() else np.ones(len(zs), dtype = bool)
+        Xs = pd.Series(nuData['Xs'])[onPlane].reset_index(drop = True)
+        Ys = pd.Series(nuData['Ys'])[onPlane].reset_index(drop = True)
+        signal = pd.Series(nuData['signal'])[onPlane].reset_index(drop = True)
+        
         # Normalize the current values
-        normCurrents = nuData['signal'] / max(nuData['signal'].min(), nuData['signal'].max(), key = abs)    # normalize against the maximum detected current
+        normCurrents = signal / max(signal.min(), signal.max(), key = abs)        # normalize against the maximum detected current
         normCurrents = normCurrents * ((normCurrents.max() - normCurrents.min()) / 2) + normCurrents        # shift the dataset up such that it is centered around 1 Sun.
         
 
@@ -77,16 +163,22 @@ def NUScript(nuData):
         cmapNorm = cm.summer
         normColourNorm = mcolors.Normalize(vmin = normCurrents.min(), vmax = normCurrents.max())
         
-        # Generate a plot with the normalized detector values.
+        # Generate a plot with the normalized detector values, drawn as one collection of detector footprints.
         fig2, ax2 = plt.subplots()
-        for xCoord, yCoord, ptColour in zip(nuData['Xs'], nuData['Ys'], normCurrents):
-            colour = cmapNorm(normColourNorm(ptColour))
-            circle = mpatches.Circle((xCoord, yCoord), radius = detDiam / 2, color = colour, alpha = 0.8)
-            ax2.add_patch(circle)
+        if surface:
+            # Smooth view: the (cached) interpolated surface of the normalized values.
+            smooth = nuSurface(Xs, Ys, normCurrents)
+            ax2.imshow(smooth['surface'], origin = 'lower', cmap = cmapNorm, norm = normColourNorm, interpolation = 'bilinear',
+                       extent = [smooth['xAxis'][0], smooth['xAxis'][-1], smooth['yAxis'][0], smooth['yAxis'][-1]])
+        else:
+            footprints = EllipseCollection(detDiam, detDiam, 0, units = 'xy', offsets = np.column_stack((Xs, Ys)),
+                                           offset_transform = ax2.transData, cmap = cmapNorm, norm = normColourNorm, alpha = 0.8)
+            footprints.set_array(np.asarray(normCurrents))
+            ax2.add_collection(footprints)
         
         # Formatting the normalized plot.
-        ax2.set_xlim(nuData['Xs'].min() - detDiam, nuData['Xs'].max() + detDiam)
-        ax2.set_ylim(nuData['Ys'].min() - detDiam, nuData['Ys'].max() + detDiam)
+        ax2.set_xlim(Xs.min() - detDiam, Xs.max() + detDiam)
+        ax2.set_ylim(Ys.min() - detDiam, Ys.max() + detDiam)
         ax2.set_aspect('equal')
         ax2.set_title('Non-Uniformity Plot: Normalized')
         ax2.set_xlabel('X Position [cm]')
@@ -104,71 +196,84 @@ def NUScript(nuData):
         
         report_d = {
             'Filename': nuData['filename'],
-            'Number of Measurement Points': len(nuData['Xs']),
+            'Number of Measurement Points': len(Xs),
             'Date of Measurement': nuData['date'],
-            'Target Area Diameter [cm]': statistics.mean([np.max(nuData['Xs']) - np.min(nuData['Xs']), np.max(nuData['Ys']) - np.min(nuData['Ys'])]),
+            'Target Area Diameter [cm]': statistics.mean([np.max(Xs) - np.min(Xs), np.max(Ys) - np.min(Ys)]),
             'Ideal Detector Area [cm^2]': nuData['detArea'],
             'Maximum Irradiance [Suns]': normCurrents.max(),
             'Minimum Irradiance [Suns]': normCurrents.min(),
             'Standard Deviation [Suns]': np.std(normCurrents),
             'Spatial Non-Uniformity of Irradiance [%]': nuData['NU']
             }
+        
+        # Largest concentric diameter (through point centres) that meets each class.
+        for label, diameter in classDiameters(pointIndex(Xs, Ys, signal)).items():
+            report_d['Largest Class ' + label + ' Diameter [cm]'] = diameter
+
+        # Remove the smearing of the detector aperture, on the interpolated surface.
+        if deconvolve:
+            smooth = nuSurface(Xs, Ys, signal)
+            corrected = nuDeconvolve(smooth, nuData['detArea'], method = deconvolve)
+            _correctedReport(report_d, corrected, deconvolve)
+
+        # Every z plane of the scan, and the z position with the lowest NU.
+        if pd.Series(nuData['Zs']).round(4).nunique() > 1:
+            planes = pointPlanes(nuData['Xs'], nuData['Ys'], nuData['Zs'], nuData['signal'])
+            _planesReport(report_d, planes)
+            report_d['Largest Class A Diameter per Z Plane [cm]'] = dict(zip(planes['z'].tolist(), planes['diameters']['A'].tolist()))
         resultsFrame = pd.DataFrame.from_dict(report_d, orient = 'index')
         # print(tabulate(resultsFrame, colalign = ('right', )))
     
     return report_d
 
-def TIScript(tiData):
+def TIScript(tiData, ltiWindow = None):
     '''
     TIScript: This function allows the user to import any number of .ivdat files, finds the dataset with the worst temporal instability, and outputs the results along with a plot for the test report.
+    ltiWindow is the long term instability window in seconds. When given, the worst LTI over any window of that length in the worst dataset is also reported.
     '''
-    # Hardcoded values
-    NPLC = 1                # number of power line cycles
-    time_btw_points = 0.19  # time in seconds
-
     # Find the dataset with the worst temporal instability
-    for setIndex, dataset in enumerate(tiData):
-        # print(dataset)
+    worstKey = None
+    for dataset in tiData:
         # We require a minimum of 20 data points. Reject any datasets with insufficient data.
-        if len(tiData[dataset]['current']) < 20:
-            print('The following datafile contains insufficient (<20) data points to properly calculate the temporal instability and will be ignored: ' + dataset['filepath'])
+        if len(tiData[dataset]['current']) < MIN_POINTS:
+            print('The following datafile contains insufficient (<20) data points to properly calculate the temporal instability and will be ignored: ' + str(tiData[dataset]['filename']))
             continue
         # Calculate the TI
-        TI = 100 * abs((tiData[dataset]['current'].max() - tiData[dataset]['current'].min()) / (tiData[dataset]['current'].max() + tiData[dataset]['current'].min()))
+        current = np.asarray(tiData[dataset]['current'], dtype = np.float64)
+        TI = instability(current.max(), current.min())
         # We only care about the dataset with the worst TI
-        if setIndex == 0:
-            worstTI = TI
-            worstIndex = setIndex
-        elif TI > worstTI:
+        if worstKey is None or TI > worstTI:
             worstTI = TI
-            worstIndex = setIndex
+            worstKey = dataset
     
-    worstData = tiData['File ' + str(worstIndex)]
+    if worstKey is None:
+        raise ValueError('None of the datafiles contain enough (>=20) data points to calculate the temporal instability.')
+    worstData = tiData[worstKey]
     
-
-    # Calculate the STI of the worst dataset
-    for currentIndex, current in enumerate(worstData['current']):
-        if currentIndex == 0:
-            continue
-        sti = 100 * abs((current - worstData['current'][currentIndex - 1]) / (current + worstData['current'][currentIndex - 1]))
-        if currentIndex == 1:
-            STI = sti
-        elif sti > STI:
-            STI = sti
+    # Number of power line cycles and time in seconds between points, from the worst dataset's header.
+    timing = pointTiming(worstData.get('spp'), worstData.get('wait'), worstData.get('dwell'))
+    NPLC = timing['NPLC']
+    time_btw_points = timing['timeStep']
+    
+    # Calculate the STI (and LTI) of the worst dataset
+    tiResult = tiStats(worstData['current'], time_btw_points, ltiWindow)
+    STI = tiResult['STI']
     
     # Assume that the average current corresponds to 1 Sun (this should be very close to true if the measurement was performed correctly)
-    sun = statistics.mean(worstData['current'])
+    sun = tiResult['sun']
     
     # Calculate the min/max irradiance in Suns based on this assumption.
-    maxIrrad = worstData['current'].max() / sun
-    minIrrad = worstData['current'].min() / sun
+    maxIrrad = tiResult['maxIrrad']
+    minIrrad = tiResult['minIrrad']
     
     # Generate a plot for the report.
     timeValues = np.linspace(0, (len(worstData['current']) - 1) * time_btw_points, len(worstData['current']))
     plt.yticks(np.arange(0.95, 1.05, step = 0.01))
     plt.ylim(0.95, 1.05)
     hLineHandle = plt.axhline(1.0, ls = '--', color = 'k')
-    scatterHandle = plt.scatter(timeValues, worstData['current'] / sun, color = 'r')
+    # Long logs are decimated to a fixed number of plotted points (keeping the extremes); the statistics above use every point.
+    plotTimes, plotIrrad = decimate(timeValues, np.asarray(worstData['current'], dtype = np.float64) / sun)
+    scatterHandle = plt.scatter(plotTimes, plotIrrad, color = 'r')
     plt.legend([hLineHandle, scatterHandle], ['1 Sun Line', 'Temporal Instability Data Points'])
     plt.xlabel('Time [s]')
     plt.ylabel('Irradiance [Suns]')
@@ -190,14 +295,50 @@ def TIScript(tiData):
         'Short Term Instability [%]': STI,
         'Temporal Instability [%]': worstTI
         }
+    if ltiWindow is not None:
+        report_d['LTI Window [s]'] = ltiWindow
+        report_d['Long Term Instability [%]'] = tiResult['LTI']
+
     # resultsFrame = pd.DataFrame.from_dict(report_d, orient = 'index')
     # print(tabulate(resultsFrame, colalign = ('right',)))
     return report_d
 
 
-def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, crosspoint):
+def FlickerScript(dataset, segmentLength = 4096):
+    '''
+    FlickerScript: This function takes one dataset from ivdatImports (e.g. the worst TI file), calculates the power spectrum of its current trace,
+    and reports the dominant fluctuation frequencies and how much of the instability falls in each frequency band, along with a plot.
+    '''
+    timing = pointTiming(dataset.get('spp'), dataset.get('wait'), dataset.get('dwell'))
+    flicker = flickerSpectrum(np.asarray(dataset['current'], dtype = np.float64), timing['timeStep'], segmentLength)
+    
+    # Generate a plot for the report.
+    plt.semilogy(flicker['frequencies'][1:], flicker['psd'][1:], color = 'r')
+    for frequency, amplitude in flicker['dominant']:
+        plt.axvline(frequency, ls = '--', color = 'k', linewidth = 0.5)
+    plt.xlabel('Frequency [Hz]')
+    plt.ylabel('Relative Power Spectral Density [1/Hz]')
+    plt.savefig("output/Flicker.png")
+    plt.clf()
+    
+    report_d = {
+        'Filename': dataset['filename'],
+        'Time Between Data Points [s]': timing['timeStep'],
+        'Number of Power Line Cycles': timing['NPLC'],
+        'Sample Rate [Hz]': flicker['sampleRate'],
+        'Dominant Frequencies [Hz]': ', '.join('%.4g (%.3g %%)' % (frequency, amplitude) for frequency, amplitude in flicker['dominant']),
+        }
+    for band, rms in flicker['bands'].items():
+        report_d['RMS Fluctuation ' + band + ' [%]'] = rms
+    
+    return report_d
+
+
+def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, crosspoint = None, stitchScale = False):
     '''
     specScript: This function take a single .ssdat file from the spectroradiometer as input, calculates its degree of matching to a given solar spectrum, then outputs the results along with a plot for the test report.
+    When both Si and InGaAs data are given they are joined by stitchSpectra: crosspoint = None picks the crosspoint automatically, a wavelength forces it.
+    stitchSpectra also fits an InGaAs scale factor when stitchScale = True.
     '''
 
     dir = os.path.abspath(os.path.dirname(__file__))
@@ -217,9 +358,6 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
     IGAHiRange = '900 - 1749 nm'
     IGALoRange = '1001 - 1749 nm'
     
-    # Standard spectra file location. Currently given relative to the script's run location.
-    stdSpecPath = os.path.join(files, 'Solar_Standards.csv')
-    
     # The main function starts here.
     ssData = {}
     
@@ -230,10 +368,10 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
         
         # Use the correct transfer function based on the gain selection.
         if status_Si == '1':
-            tFunc_Si = pd.read_csv(SiHi, names = ('tWaves', 'tdata'))
+            tFunc_Si = transferFunction(SiHi)
             print('\nThe HI gain transfer function for this Si detector is defined across the range of ' + SiHiRange + '.')
         elif status_Si == '2':
-            tFunc_Si = pd.read_csv(SiLo, names = ('tWaves', 'tdata'))
+            tFunc_Si = transferFunction(SiLo)
             print('\nThe LO gain transfer function for this Si detector is defined across the range of ' + SiLoRange + '.')
         
         # Use the transfer function to convert the Si voltage data to spectral irradiance.
@@ -246,10 +384,10 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
         
         # Use the correct transfer function based on the gain selection.
         if status_IGA == '1':
-            tFunc_IGA = pd.read_csv(IGAHi, names = ('tWaves', 'tdata'))
+            tFunc_IGA = transferFunction(IGAHi)
             print('\nThe HI gain transfer function for this InGaAs detector is defined across the range of ' + IGAHiRange + '.')
         elif status_IGA == '2':
-            tFunc_IGA = pd.read_csv(IGALo, names = ('tWaves', 'tdata'))
+            tFunc_IGA = transferFunction(IGALo)
             print('\nThe LO gain transfer function for this InGaAs detector is defined across the range of ' + IGALoRange + '.')
         
         # Use the transfer function to convert the InGaAs voltage data to spectral irradiance.
@@ -263,19 +401,14 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
         plt.xlabel('Wavlength [nm]')
         plt.ylabel('Spectral Irradiance [W/m^2/nm]')
                 
-        # trim the Si data
-        trimmedIndices_Si = np.where(irrad_Si['irradWaves'] <= crosspoint)[0]
-        trimmedWaves_Si = irrad_Si['irradWaves'][trimmedIndices_Si]
-        trimmedIrrad_Si = irrad_Si['irrad'][trimmedIndices_Si]
-        
-        # trim the InGaAs data.
-        trimmedIndices_IGA = np.where(irrad_IGA['irradWaves'] > crosspoint)[0]
-        trimmedWaves_IGA = irrad_IGA['irradWaves'][trimmedIndices_IGA]
-        trimmedIrrad_IGA = irrad_IGA['irrad'][trimmedIndices_IGA]
-        
-        # combined wavelength and irradiance data
-        waves = np.concatenate((trimmedWaves_Si, trimmedWaves_IGA))
-        irrad = np.concatenate((trimmedIrrad_Si, trimmedIrrad_IGA))
+        # Join the two detectors where they agree best in the overlap, unless the user fixed the crosspoint.
+        stitch = stitchSpectra(irrad_Si['irradWaves'], irrad_Si['irrad'], irrad_IGA['irradWaves'], irrad_IGA['irrad'],
+                               scale = stitchScale, crosspoint = crosspoint)
+        waves = stitch['irradWaves']
+        irrad = stitch['irrad']
+        plt.axvline(stitch['crosspoint'], color = 'gray', linestyle = '--', linewidth = 0.8)
+        print('\nSi and InGaAs data joined at ' + str(stitch['crosspoint']) + ' nm (InGaAs scale ' + str(round(stitch['scale'], 4)) + ', step '
+              + str(round(stitch['stepPercent'], 2)) + ' %, local mismatch ' + str(round(stitch['residual'], 2)) + ' %).')
         
         # Location to save results to. Defaults to the location of the Si data file when both types are present.
         savePath = ssData['siData']['folder']
@@ -291,318 +424,30 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
         irrad = irrad_IGA['irradWaves']
         savePath = ssData['igaData']['folder']
     
-    # Import the reference spectra.
-    specRef = pd.read_csv(
-        stdSpecPath,
-        sep=',',
-        header=0,
-        engine='python',
-        names=['Wavelengths', 'AM0 Irrad', 'AM1.5G Irrad', 'AM1.5D Irrad', 'AM0 Rad', 'AM1.5G Rad', 'AM1.5D Rad'],
-    )
+    # Import the reference spectra (read once per process).
+    specRef = referenceLoad()
 
     
-    if AMType == '1':
-        refIrrad = specRef['AM1.5D Irrad'] / 10000
-    elif AMType == '2':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    elif AMType == '3':
-        refIrrad = specRef['AM0 Irrad'] / 10000
-    elif AMType == '4':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    elif AMType == '5':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    elif AMType == '6':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    else:
-        pass
-    
-    # Interpolate the collected data so it has the same resolution as the reference spectrum (1 nm steps)
-    interpWaves = np.round(np.arange(round(min(waves), 1), round(max(waves), 1) + 0.1, 0.1), 3)
-    
-    interper = interpolate.interp1d(waves, irrad)
-    interpIrrad = interper(interpWaves)
-    
-    # Load the ASTM wavelength bins and intensity percentage, depending on the reference spectrum.
-    if AMType == '1':       # ASTM AM1.5D
-        print('\nTesting for AM1.5D Direct Normal ASTM E927-19')
-        lowerBounds = np.array((400, 500, 600, 700, 800, 900))
-        upperBounds = np.array((500, 600, 700, 800, 900, 1100))
-        ratios = np.array((16.75, 19.49, 18.36, 15.08, 12.82, 16.69))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['400-500', '500-600', '600-700', '700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5D classification under ASTM E927-19.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5D classification under ASTM E927-19.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    if AMType == '2':   # ASTM AM1.5G
-        print('\nTesting for AM1.5G Hemispherical ASTM E927-19')
-        lowerBounds = np.array((400, 500, 600, 700, 800, 900))
-        upperBounds = np.array((500, 600, 700, 800, 900, 1100))
-        ratios = np.array((18.21, 19.73, 18.20, 14.79, 12.39, 15.89))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['400-500', '500-600', '600-700', '700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under ASTM E927-19.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under ASTM E927-19.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    if AMType == '3':   # ASTM AM0
-        print('\nTesting for AM0 Extra-Terrestrial ASTM E927-19')
-        lowerBounds = np.array((350, 400, 500, 600, 700, 800, 900, 1100))
-        upperBounds = np.array((400, 500, 600, 700, 800, 900, 1100, 1400))
-        ratios = np.array((4.67, 16.80, 16.68, 14.28, 11.31, 8.98, 13.50, 12.56))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['350-400', '400-500', '500-600', '600-700', '700-800', '800-900', '900-1100', '1100-1400']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[7]:
-            print('Your data does not cover the complete wavelength range (350 - 1400 nm) required for AM0 classification under ASTM E927-19.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (350 - 1400 nm) required for AM0 classification under ASTM E927-19.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[7])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    if AMType == '4':   # AM1.5G: IEC Table 1
-        print('\nTesting for AM1.5G IEC 60904-9 Ed.3 Table 1')
-        lowerBounds = np.array((400, 500, 600, 700, 800, 900))
-        upperBounds = np.array((500, 600, 700, 800, 900, 1100))
-        ratios = np.array((18.4, 19.9, 18.4, 14.9, 12.5, 15.9))
-        stairsLO = ratios * 0.75
-        stairsHI = ratios * 1.25
-        binLabels = ['400-500', '500-600', '600-700', '700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under IEC 60904-9, Table 1.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under IEC 60904-9, Table 1.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    elif AMType == '5':     # AM1.5G: IEC Table 2
-        print('\nTesting for AM1.5G IEC 60904-9 Ed. 3 Table 2')
-        lowerBounds = np.array((300, 470, 561, 657, 772, 919))
-        upperBounds = np.array((470, 561, 657, 772, 919, 1200))
-        ratios = np.array((16.61, 16.74, 16.67, 16.63, 16.66, 16.69))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['300-470', '470-561', '561-657', '657-772', '772-919', '919-1200']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelenth range (300 - 1200 nm) required for AM1.5G classification under IEC 60904-9, Table 2.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (300 - 1200 nm) required for AM1.5G classification under IEC 60904-9, Table 2.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    elif AMType == '6':     # AM1.5G, 700 - 1100 nm only
-        print('\nTesting for AM1.5G Hemispherical ASTM E927-19, Limited Range [700 - 1100 nm]')
-        lowerBounds = np.array((700, 800, 900))
-        upperBounds = np.array((800, 900, 1100))
-        ratios = np.array((34.4, 28.7, 36.9))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[2]:
-            print('Your data does not cover the complete wavelength (700 - 1100) for this comparison.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength (700 - 1100) for this comparison.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[2])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    # Calculate the absolute error between the normalized measured spectrum and the reference spectrum (This was erroneously called the SPD in the original MATLAB script).
-    errorCheckWaves = np.round(np.arange(max(300, min(waves)), min(1200.1, max(waves) + 0.1), 0.1), 3)
-    errorCheckIrrad = interper(errorCheckWaves)
-    errorCheckInterper = interpolate.interp1d(specRef['Wavelengths'], refIrrad)
-    errorCheck = errorCheckInterper(errorCheckWaves)
-    errorCheckIrrad = errorCheckIrrad / sum(errorCheckIrrad) * sum(errorCheck)
-    absError = sum(abs(errorCheckIrrad - errorCheck)) / sum(errorCheck) * 100
-    
-    # Calculate the aggregate SPC
-    SPC_loop = np.zeros(len(errorCheckWaves))
-    for loop in np.arange(len(SPC_loop)):
-        if errorCheckIrrad[loop] > errorCheck[loop] * 0.1:
-            SPC_loop[loop] = errorCheck[loop]
-        else:
-            SPC_loop[loop] = 0
-    SPC = sum(SPC_loop) / sum(errorCheck) * 100
+    standard = standardsLoad()[AMType]
+    refIrrad = specRef[standard['reference']] / 10000
+    
+    # Compare what % of the total irradiance falls into each of the standard's wavelength bins, integrating over the native samples.
+    print('\nTesting for ' + standard['name'])
+    binResult = binClassify(standard, np.asarray(waves, dtype = np.float64), np.asarray(irrad, dtype = np.float64))
+    if binResult is None:
+        return
+    percents = binResult['percents']
+    classLetters = binResult['classLetters']
+    lowerBounds = standard['lowerBounds']
+    upperBounds = standard['upperBounds']
+    stairsLO = standard['ratios'] * 0.75    # Class A lower bounds for stair plot
+    stairsHI = standard['ratios'] * 1.25    # Class A upper bounds for stair plot
+    binLabels = standard['binLabels']
+    
+    # Calculate the spectral deviation (SPD) between the normalized measured spectrum and the reference spectrum, and the aggregate spectral coverage (SPC).
+    deviation = spdSpc(np.asarray(waves, dtype = np.float64), np.asarray(irrad, dtype = np.float64), specRef['Wavelengths'], refIrrad)
+    absError = deviation['SPD']
+    SPC = deviation['SPC']
     
     # Generating Plots
     # Instantiate some lists to fill in loops
@@ -622,39 +467,13 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
         stepsHI.append(stairsHI[bound])
     
     # Set the wavelength bounds depending on the spectrum being matched to
-    if AMType == '1':
-        plt1x = np.arange(400, 1101, 1)
-        xLims = [400, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5D'
-        AM = 'AM1.5D, ASTM E927-19'
-    elif AMType == '2':
-        plt1x = np.arange(400, 1101, 1)
-        xLims = [400, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, ASTM E927-19'
-    elif AMType == '3':
-        plt1x = np.arange(350, 1401, 1)
-        xLims = [350, 1400]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM0'
-        AM = 'AM0, ASTM E927-19'
-    elif AMType == '4':
-        plt1x = np.arange(300, 1101, 1)
-        xLims = [400, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, IEC Table 1'
-    elif AMType == '5':
-        plt1x = np.arange(300, 1201, 1)
-        xLims = [300, 1200]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, IEC Table 2'
-    elif AMType == '6':
-        plt1x = np.arange(700, 1101, 1)
-        xLims = [700, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, ASTM E927-19'
+    plt1x = np.arange(lowerBounds[0], upperBounds[-1] + 1, 1)
+    xLims = [lowerBounds[0], upperBounds[-1]]
+    stdLeg = standard['legend']
+    AM = standard['AM']
     
     # Normalize the data to overlap with SMARTS standard data.
-    normFactor = errorCheckInterper(plt1x)
+    normFactor = np.interp(plt1x, specRef['Wavelengths'], refIrrad)
     plotInterper = interpolate.interp1d(waves, irrad)
     plt1y = plotInterper(plt1x)
     plt1y = plt1y / sum(plt1y) * sum(normFactor)    # Normalize the data to overlap with SMARTS standard data
@@ -689,7 +508,6 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
     ax2.set_title('Spectral Irradiance Ratios, Compared to ' + AM, weight = 'bold', fontsize = 5)
     
     # Bottom Right Table
-    percents[bucket] = np.around(percents[bucket], 2)   # round them to 2 decimal places
     plotTable = {
         'Wavelength Interval [nm]': binLabels,
         'Ratio of Interval Irradiance [%]': np.round(percents, 2),
@@ -705,8 +523,7 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
     plt.savefig("output/SM.png", dpi=300)
     
     # classification
-    grade_order = ['A+', 'A', 'B', 'C', 'D', 'U']
-    classification = max(classLetters, key=lambda g: grade_order.index(g))
+    classification = binResult['classification']
 
     saveCheck = rawdata
     savePath = 'output'
@@ -730,6 +547,8 @@ def SMScript(status_Si, status_IGA, AMType, SiData, IGAData, label, rawdata, cro
             'Date of Si Measurement': ssData['siData']['date'],
             'Filename of InGaAs Measurement': ssData['igaData']['filename'],
             'Date of InGaAs Measurement': ssData['igaData']['filename'],
+            'Stitch Crosspoint [nm]': stitch['crosspoint'],
+            'Stitch Step [%]': round(stitch['stepPercent'], 4),
             'SPD Absolute Error [%]': round(absError, 4),
             'Aggregate SPC [%]': round(SPC, 4),
             'Classification': classification,
@@ -765,332 +584,30 @@ def SMScript2(AMType, fullData, label):
     specScript2: This function works with sidat file instead
     '''
 
-    dir = os.path.abspath(os.path.dirname(__file__))
-    parent_dir = os.path.dirname(dir)
-    files = os.path.join(parent_dir, 'required_files')
-
-    
-    # Standard spectra file location. Currently given relative to the script's run location.
-    stdSpecPath = os.path.join(files, 'Solar_Standards.csv')
-    
     # The main function starts here.
     print(fullData)
 
-    waves = [float(w) for w in fullData['wavelengths'][:-5]]
-    irrad = [float(i) for i in fullData['irradiance'][:-5]]
-
+    waves, irrad = sidatSpectrum(fullData)
 
-    # Import the reference spectra.
-    specRef = pd.read_csv(
-        stdSpecPath,
-        sep=',',
-        header=0,
-        engine='python',
-        names=['Wavelengths', 'AM0 Irrad', 'AM1.5G Irrad', 'AM1.5D Irrad', 'AM0 Rad', 'AM1.5G Rad', 'AM1.5D Rad'],
-    )
-
-    
-    if AMType == '1':
-        refIrrad = specRef['AM1.5D Irrad'] / 10000
-    elif AMType == '2':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    elif AMType == '3':
-        refIrrad = specRef['AM0 Irrad'] / 10000
-    elif AMType == '4':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    elif AMType == '5':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    elif AMType == '6':
-        refIrrad = specRef['AM1.5G Irrad'] / 10000
-    else:
-        pass
-    
-    # Interpolate the collected data so it has the same resolution as the reference spectrum (1 nm steps)
-    interpWaves = np.round(np.arange(round(min(waves), 1), round(max(waves), 1) + 0.1, 0.1), 3)
-    interper = interpolate.interp1d(waves, irrad, bounds_error=False, fill_value="extrapolate")
-    interpIrrad = interper(interpWaves)
-    
-    # Load the ASTM wavelength bins and intensity percentage, depending on the reference spectrum.
-    if AMType == '1':       # ASTM AM1.5D
-        print('\nTesting for AM1.5D Direct Normal ASTM E927-19')
-        lowerBounds = np.array((400, 500, 600, 700, 800, 900))
-        upperBounds = np.array((500, 600, 700, 800, 900, 1100))
-        ratios = np.array((16.75, 19.49, 18.36, 15.08, 12.82, 16.69))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['400-500', '500-600', '600-700', '700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5D classification under ASTM E927-19.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5D classification under ASTM E927-19.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    if AMType == '2':   # ASTM AM1.5G
-        print('\nTesting for AM1.5G Hemispherical ASTM E927-19')
-        lowerBounds = np.array((400, 500, 600, 700, 800, 900))
-        upperBounds = np.array((500, 600, 700, 800, 900, 1100))
-        ratios = np.array((18.21, 19.73, 18.20, 14.79, 12.39, 15.89))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['400-500', '500-600', '600-700', '700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under ASTM E927-19.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under ASTM E927-19.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    if AMType == '3':   # ASTM AM0
-        print('\nTesting for AM0 Extra-Terrestrial ASTM E927-19')
-        lowerBounds = np.array((350, 400, 500, 600, 700, 800, 900, 1100))
-        upperBounds = np.array((400, 500, 600, 700, 800, 900, 1100, 1400))
-        ratios = np.array((4.67, 16.80, 16.68, 14.28, 11.31, 8.98, 13.50, 12.56))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['350-400', '400-500', '500-600', '600-700', '700-800', '800-900', '900-1100', '1100-1400']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[7]:
-            print('Your data does not cover the complete wavelength range (350 - 1400 nm) required for AM0 classification under ASTM E927-19.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (350 - 1400 nm) required for AM0 classification under ASTM E927-19.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[7])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    if AMType == '4':   # AM1.5G: IEC Table 1
-        print('\nTesting for AM1.5G IEC 60904-9 Ed.3 Table 1')
-        lowerBounds = np.array((400, 500, 600, 700, 800, 900))
-        upperBounds = np.array((500, 600, 700, 800, 900, 1100))
-        ratios = np.array((18.4, 19.9, 18.4, 14.9, 12.5, 15.9))
-        stairsLO = ratios * 0.75
-        stairsHI = ratios * 1.25
-        binLabels = ['400-500', '500-600', '600-700', '700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under IEC 60904-9, Table 1.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (400 - 1100 nm) required for AM1.5G classification under IEC 60904-9, Table 1.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    elif AMType == '5':     # AM1.5G: IEC Table 2
-        print('\nTesting for AM1.5G IEC 60904-9 Ed. 3 Table 2')
-        lowerBounds = np.array((300, 470, 561, 657, 772, 919))
-        upperBounds = np.array((470, 561, 657, 772, 919, 1200))
-        ratios = np.array((16.61, 16.74, 16.67, 16.63, 16.66, 16.69))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['300-470', '470-561', '561-657', '657-772', '772-919', '919-1200']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[5]:
-            print('Your data does not cover the complete wavelenth range (300 - 1200 nm) required for AM1.5G classification under IEC 60904-9, Table 2.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength range (300 - 1200 nm) required for AM1.5G classification under IEC 60904-9, Table 2.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[5])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    elif AMType == '6':     # AM1.5G, 700 - 1100 nm only
-        print('\nTesting for AM1.5G Hemispherical ASTM E927-19, Limited Range [700 - 1100 nm]')
-        lowerBounds = np.array((700, 800, 900))
-        upperBounds = np.array((800, 900, 1100))
-        ratios = np.array((34.4, 28.7, 36.9))
-        stairsLO = ratios * 0.75    # Class A lower bounds for stair plot
-        stairsHI = ratios * 1.25    # Class A upper bounds for stair plot
-        binLabels = ['700-800', '800-900', '900-1100']
-        
-        # Ensure that there is enough data to fulfill standard requirements.
-        if interpWaves[-1] < upperBounds[2]:
-            print('Your data does not cover the complete wavelength (700 - 1100) for this comparison.')
-            return
-        if interpWaves[0] > lowerBounds[0]:
-            print('Your data does not cover the complete wavelength (700 - 1100) for this comparison.')
-            return
-        
-        topLimit = np.where(interpWaves == upperBounds[2])[0][0]
-        lowLimit = np.where(interpWaves == lowerBounds[0])[0][0]
-        
-        # Sum the irradiance between the limits. This will only be used for % comparisons against itself, so we don't need to account for the change in number of data points due to interpolation.
-        irradSum = np.sum(interpIrrad[lowLimit:topLimit + 1])
-        
-        # Compare what % of the total irradiance falls into each wavelength bucket.
-        classLetters = []
-        percents = []
-        for bucket in np.arange(len(binLabels)):
-            topBucketLim = np.where(interpWaves == upperBounds[bucket])[0][0]
-            lowBucketLim = np.where(interpWaves == lowerBounds[bucket])[0][0]
-            buckSum = np.sum(interpIrrad[lowBucketLim:topBucketLim + 1])
-            percents.append(buckSum / irradSum * 100)
-            
-            # Record the spectral match classification for each bucket.
-            if percents[bucket] >= ratios[bucket] * 0.875 and percents[bucket] <= ratios[bucket] * 1.125:
-                classLetters.append('A+')
-            elif percents[bucket] >= ratios[bucket] * 0.75 and percents[bucket] <= ratios[bucket] * 1.25:
-                classLetters.append('A')
-            elif percents[bucket] >= ratios[bucket] * 0.6 and percents[bucket] <= ratios[bucket] * 1.4:
-                classLetters.append('B')
-            elif percents[bucket] >= ratios[bucket] * 0.4 and percents[bucket] <= ratios[bucket] * 2.0:
-                classLetters.append('C')
-            else:
-                classLetters.append('U')
-    
-    # Calculate the absolute error between the normalized measured spectrum and the reference spectrum (This was erroneously called the SPD in the original MATLAB script).
-    errorCheckWaves = np.round(np.arange(max(300, min(waves)), min(1200.1, max(waves) + 0.1), 0.1), 3)
-    errorCheckIrrad = interper(errorCheckWaves)
-    errorCheckInterper = interpolate.interp1d(specRef['Wavelengths'], refIrrad)
-    errorCheck = errorCheckInterper(errorCheckWaves)
-    errorCheckIrrad = errorCheckIrrad / sum(errorCheckIrrad) * sum(errorCheck)
-    absError = sum(abs(errorCheckIrrad - errorCheck)) / sum(errorCheck) * 100
-    
-    # Calculate the aggregate SPC
-    SPC_loop = np.zeros(len(errorCheckWaves))
-    for loop in np.arange(len(SPC_loop)):
-        if errorCheckIrrad[loop] > errorCheck[loop] * 0.1:
-            SPC_loop[loop] = errorCheck[loop]
-        else:
-            SPC_loop[loop] = 0
-    SPC = sum(SPC_loop) / sum(errorCheck) * 100
+    # Import the reference spectra (read once per process).
+    specRef = referenceLoad()
+    standard = standardsLoad()[AMType]
+    refIrrad = specRef[standard['reference']] / 10000
+    
+    # Compare what % of the total irradiance falls into each of the standard's wavelength bins, and calculate the SPD and SPC.
+    print('\nTesting for ' + standard['name'])
+    smResult = classifyAll(fullData, [AMType])[AMType]
+    if smResult is None:
+        return
+    percents = smResult['percents']
+    classLetters = smResult['classLetters']
+    absError = smResult['SPD']
+    SPC = smResult['SPC']
+    lowerBounds = standard['lowerBounds']
+    upperBounds = standard['upperBounds']
+    stairsLO = standard['ratios'] * 0.75    # Class A lower bounds for stair plot
+    stairsHI = standard['ratios'] * 1.25    # Class A upper bounds for stair plot
+    binLabels = standard['binLabels']
     
     # Generating Plots
     # Instantiate some lists to fill in loops
@@ -1110,39 +627,13 @@ def SMScript2(AMType, fullData, label):
         stepsHI.append(stairsHI[bound])
     
     # Set the wavelength bounds depending on the spectrum being matched to
-    if AMType == '1':
-        plt1x = np.arange(400, 1101, 1)
-        xLims = [400, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5D'
-        AM = 'AM1.5D, ASTM E927-19'
-    elif AMType == '2':
-        plt1x = np.arange(400, 1101, 1)
-        xLims = [400, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, ASTM E927-19'
-    elif AMType == '3':
-        plt1x = np.arange(350, 1401, 1)
-        xLims = [350, 1400]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM0'
-        AM = 'AM0, ASTM E927-19'
-    elif AMType == '4':
-        plt1x = np.arange(300, 1101, 1)
-        xLims = [400, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, IEC Table 1'
-    elif AMType == '5':
-        plt1x = np.arange(300, 1201, 1)
-        xLims = [300, 1200]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, IEC Table 2'
-    elif AMType == '6':
-        plt1x = np.arange(700, 1101, 1)
-        xLims = [700, 1100]
-        stdLeg = 'ASTM G173-03 Reference Spectrum: AM1.5G'
-        AM = 'AM1.5G, ASTM E927-19'
+    plt1x = np.arange(lowerBounds[0], upperBounds[-1] + 1, 1)
+    xLims = [lowerBounds[0], upperBounds[-1]]
+    stdLeg = standard['legend']
+    AM = standard['AM']
     
     # Normalize the data to overlap with SMARTS standard data.
-    normFactor = errorCheckInterper(plt1x)
+    normFactor = np.interp(plt1x, specRef['Wavelengths'], refIrrad)
     plotInterper = interpolate.interp1d(waves, irrad)
     plt1y = plotInterper(plt1x)
     plt1y = plt1y / sum(plt1y) * sum(normFactor)    # Normalize the data to overlap with SMARTS standard data
@@ -1177,7 +668,6 @@ def SMScript2(AMType, fullData, label):
     ax2.set_title('Spectral Irradiance Ratios, Compared to ' + AM, weight = 'bold', fontsize = 5)
     
     # Bottom Right Table
-    percents[bucket] = np.around(percents[bucket], 2)   # round them to 2 decimal places
     plotTable = {
         'Wavelength Interval [nm]': binLabels,
         'Ratio of Interval Irradiance [%]': np.round(percents, 2),
@@ -1193,8 +683,7 @@ def SMScript2(AMType, fullData, label):
     plt.savefig("output/SM.png", dpi=300)
     
     # classification
-    grade_order = ['A+', 'A', 'B', 'C', 'D', 'U']
-    classification = max(classLetters, key=lambda g: grade_order.index(g))
+    classification = smResult['classification']
     dataToSave = {
         'Wavelengths [nm]': waves,
         'Spectral Irradiance [W/m^2/nm]': irrad
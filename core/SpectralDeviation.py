@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Spectral deviation (SPD) and spectral coverage (SPC) as defined in IEC 60904-9 Ed.3.
+Every function accepts a single spectrum or an (N, wavelengths) stack of spectra that share one wavelength grid.
+"""
+import numpy as np
+from scipy import sparse
+
+# IEC 60904-9 Ed.3 evaluates SPD and SPC over 300 - 1200 nm. The default bands for the per-band contributions are the Table 2 intervals.
+IEC_WINDOW = (300, 1200)
+IEC_BANDS = np.array((300, 470, 561, 657, 772, 919, 1200), dtype = np.float64)
+
+
+def resample(waves, irrad, grid):
+    '''
+    resample linearly interpolates a spectrum (or a stack of spectra) from its sorted wavelength grid `waves` onto `grid`.
+    The interpolation is applied as a sparse (two weights per output point) matrix product, so a whole stack is resampled in one call.
+    Points of `grid` outside `waves` are extrapolated from the first or last interval.
+    '''
+    waves = np.asarray(waves, dtype = np.float64)
+    grid = np.asarray(grid, dtype = np.float64)
+    index = np.clip(np.searchsorted(waves, grid, side = 'right') - 1, 0, len(waves) - 2)
+    fraction = (grid - waves[index]) / (waves[index + 1] - waves[index])
+    rows = np.arange(len(grid))
+    weights = sparse.csr_matrix((np.concatenate((1 - fraction, fraction)), (np.concatenate((rows, rows)), np.concatenate((index, index + 1)))),
+                                shape = (len(grid), len(waves)))
+    return np.asarray(np.asarray(irrad, dtype = np.float64) @ weights.T)
+
+
+def spdSpc(waves, irrad, refWaves, refIrrad, threshold = 0.1, bands = IEC_BANDS, window = IEC_WINDOW, step = 0.1):
+    '''
+    spdSpc calculates the spectral deviation and spectral coverage of a measured spectrum against a reference spectrum.
+    Both are evaluated at `step` nm intervals over `window` (or as much of it as the measurement covers), after scaling the measurement to the reference's total irradiance.
+        SPD = sum(|measured - reference|) / sum(reference) * 100
+        SPC = sum(reference where measured >= threshold * reference) / sum(reference) * 100
+    `bands` are the band edges used to split both metrics into per-band contributions; a point on a shared edge belongs to the upper band.
+    Returns a dictionary with 'SPD' and 'SPC' (scalars, or (N,) arrays for a stack), 'bandSPD' and 'bandSPC' (one entry per band) and the evaluation grid 'waves'.
+    '''
+    waves = np.asarray(waves, dtype = np.float64)
+    grid = np.round(np.arange(max(window[0], waves.min()), min(window[1] + step, waves.max() + step), step), 3)
+
+    measured = resample(waves, irrad, grid)
+    reference = np.interp(grid, refWaves, refIrrad)
+    refSum = reference.sum()
+    measured *= refSum / measured.sum(axis = -1, keepdims = True)
+    covered = measured >= reference * threshold
+
+    # The absolute deviation is computed in place to keep large stacks to a single working array.
+    deviation = np.subtract(measured, reference, out = measured)
+    np.abs(deviation, out = deviation)
+
+    # Band membership matrix, so the per-band sums are one matrix product each. Points outside all bands only count towards the totals.
+    bands = np.asarray(bands, dtype = np.float64)
+    bandIndex = np.searchsorted(bands, grid, side = 'right') - 1
+    bandIndex[grid == bands[-1]] = len(bands) - 2
+    inBand = (bandIndex >= 0) & (bandIndex < len(bands) - 1)
+    membership = np.zeros((len(grid), len(bands) - 1))
+    membership[np.nonzero(inBand)[0], bandIndex[inBand]] = 1.0
+    covered = covered.astype(np.float64)
+    scale = 100 / refSum
+
+    theDictionary = {
+        'SPD': (deviation.sum(axis = -1) * scale)[()],
+        'SPC': (covered @ reference * scale)[()],
+        'bandSPD': deviation @ membership * scale,
+        'bandSPC': covered @ (membership * reference[:, None]) * scale,
+        'bandEdges': bands,
+        'waves': grid,
+    }
+    return theDictionary
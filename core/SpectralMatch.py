@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Spectral match (SM) classification against the ASTM E927-19 and IEC 60904-9 Ed.3 standards.
+The wavelength bins and ratios for every standard live in required_files/SM_Standards.csv.
+"""
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from .SpectralDeviation import spdSpc
+from .ReferenceData import FILES_DIR, REFERENCE_PATH, REFERENCE_NAMES, referenceTable
+
+# Standards table location, relative to the repository root.
+STANDARDS_PATH = os.path.join(FILES_DIR, 'SM_Standards.csv')
+
+# Per-bin classification limits, given as a fraction of the standard's ratio, from the best grade to the worst.
+GRADE_LIMITS = (
+    ('A+', 0.875, 1.125),
+    ('A', 0.75, 1.25),
+    ('B', 0.6, 1.4),
+    ('C', 0.4, 2.0),
+)
+GRADE_ORDER = ['A+', 'A', 'B', 'C', 'D', 'U']
+COMPILED_GRIDS = 8      # wavelength grids whose edge positions are kept per standard
+
+_standards = {}
+
+
+def standardsLoad(path = STANDARDS_PATH):
+    '''
+    standardsLoad reads the spectral match standards table into a dictionary keyed by AMType ('1', '2', ...).
+    The table is only read once per path; later calls return the cached registry.
+    Adding a standard only requires adding its rows to the table.
+    '''
+    if path in _standards:
+        return _standards[path]
+
+    table = pd.read_csv(path, dtype = {'AMType': str})
+    standards = {}
+    for AMType, rows in table.groupby('AMType', sort = False):
+        lowerBounds = rows['Lower [nm]'].to_numpy(dtype = np.float64)
+        upperBounds = rows['Upper [nm]'].to_numpy(dtype = np.float64)
+        edges = np.unique(np.concatenate((lowerBounds, upperBounds)))
+        reference = rows['Reference'].iloc[0]
+        standards[AMType] = {
+            'AMType': AMType,
+            'name': rows['Standard'].iloc[0],
+            'AM': rows['AM'].iloc[0],
+            'reference': reference,
+            'legend': 'ASTM G173-03 Reference Spectrum: ' + reference.replace(' Irrad', ''),
+            'lowerBounds': lowerBounds,
+            'upperBounds': upperBounds,
+            'ratios': rows['Ratio [%]'].to_numpy(dtype = np.float64),
+            'binLabels': ['%g-%g' % bounds for bounds in zip(lowerBounds, upperBounds)],
+            'edges': edges,
+            'lowerEdge': np.searchsorted(edges, lowerBounds),  # position of each bin's edges within 'edges'
+            'upperEdge': np.searchsorted(edges, upperBounds),
+            'compiled': {},                                    # edge indices per wavelength grid, filled by standardCompile
+        }
+
+    _standards[path] = standards
+    return standards
+
+
+def cumulativeIntegral(waves, irrad):
+    '''
+    cumulativeIntegral returns the running trapezoidal integral of irrad over waves, starting at 0 on the first sample.
+    irrad can be a single spectrum or an (N, wavelengths) stack sharing the same wavelength grid.
+    '''
+    irrad = np.asarray(irrad, dtype = np.float64)
+    areas = 0.5 * (irrad[..., 1:] + irrad[..., :-1]) * np.diff(waves)
+    cumIrrad = np.zeros(irrad.shape)
+    np.cumsum(areas, axis = -1, out = cumIrrad[..., 1:])
+    return cumIrrad
+
+
+def edgeLocate(waves, edges):
+    '''
+    edgeLocate finds where each edge falls on the sorted wavelength grid `waves`.
+    Returns the index of the sample at or below each edge, the distance from that sample to the edge and the edge's fractional position in that interval.
+    Edges outside the grid are clamped to the first or last interval.
+    '''
+    waves = np.asarray(waves, dtype = np.float64)
+    index = np.clip(np.searchsorted(waves, edges, side = 'right') - 1, 0, len(waves) - 2)
+    offset = np.asarray(edges, dtype = np.float64) - waves[index]
+    fraction = offset / (waves[index + 1] - waves[index])
+    return index, offset, fraction
+
+
+def edgeIntegrals(irrad, cumIrrad, located):
+    '''
+    edgeIntegrals evaluates the integral of the piecewise-linear spectrum from the first sample up to each located edge (see edgeLocate).
+    It adds the partial trapezoid between the sample below the edge and the edge itself, so the result is exact for linear interpolation.
+    '''
+    index, offset, fraction = located
+    irrad = np.asarray(irrad, dtype = np.float64)
+    low = irrad[..., index]
+    high = irrad[..., index + 1]
+    return cumIrrad[..., index] + offset * (low + 0.5 * fraction * (high - low))
+
+
+def standardCompile(standard, waves):
+    '''
+    standardCompile locates the standard's bin edges on the (sorted) wavelength grid `waves` with edgeLocate.
+    The result is cached on the standard by the length and SHA-1 digest of the grid, so repeated calls on the same grid skip the search.
+    Only the last COMPILED_GRIDS grids are kept; the oldest is dropped when a new one arrives.
+    '''
+    waves = np.ascontiguousarray(waves, dtype = np.float64)
+    key = (len(waves), hashlib.sha1(waves.tobytes()).hexdigest())
+    compiled = standard['compiled']
+    if key not in compiled:
+        if len(compiled) >= COMPILED_GRIDS:
+            compiled.pop(next(iter(compiled)))
+        compiled[key] = edgeLocate(waves, standard['edges'])
+    return compiled[key]
+
+
+def _gradeRanks(percents, ratios):
+    '''
+    Returns the position in GRADE_ORDER of each bin's grade, so grades can be compared numerically.
+    '''
+    relative = np.asarray(percents) / ratios
+    conditions = [(relative >= low) & (relative <= high) for _, low, high in GRADE_LIMITS]
+    return np.select(conditions, [GRADE_ORDER.index(grade) for grade, _, _ in GRADE_LIMITS], default = GRADE_ORDER.index('U'))
+
+
+def gradeBins(percents, ratios):
+    '''
+    gradeBins returns the class letter ('A+', 'A', 'B', 'C' or 'U') for each bin percentage against the standard's ratios.
+    percents can hold one spectrum's bins or an (N, bins) stack.
+    '''
+    return np.array(GRADE_ORDER)[_gradeRanks(percents, ratios)]
+
+
+def worstGrade(classLetters):
+    '''
+    worstGrade returns the overall classification, which is the worst of the per-bin grades.
+    '''
+    return max(classLetters, key = GRADE_ORDER.index)
+
+
+def _binPercents(standard, waves, irrad, cumIrrad = None):
+    '''
+    Returns the % of the total irradiance in each of the standard's bins for one spectrum or an (N, wavelengths) stack,
+    or None (after telling the user) if the wavelength grid does not cover the standard.
+    '''
+    lowerBounds = standard['lowerBounds']
+    upperBounds = standard['upperBounds']
+    if waves[-1] < upperBounds[-1] or waves[0] > lowerBounds[0]:
+        print('Your data does not cover the complete wavelength range (%g - %g nm) required for %s.' % (lowerBounds[0], upperBounds[-1], standard['name']))
+        return None
+
+    if cumIrrad is None:
+        cumIrrad = cumulativeIntegral(waves, irrad)
+    edgeIrrad = edgeIntegrals(irrad, cumIrrad, standardCompile(standard, waves))
+
+    # Integrate the irradiance in each bin and across the full range.
+    binIrrad = edgeIrrad[..., standard['upperEdge']] - edgeIrrad[..., standard['lowerEdge']]
+    totalIrrad = edgeIrrad[..., -1:] - edgeIrrad[..., :1]
+    return binIrrad / totalIrrad * 100
+
+
+def binClassify(standard, waves, irrad, cumIrrad = None):
+    '''
+    binClassify compares what % of the total irradiance falls into each of the standard's wavelength bins and grades each bin.
+    The spectrum is integrated exactly as a piecewise-linear function of the native samples, so bins that share an edge do not double count it.
+    waves must be sorted; cumIrrad (from cumulativeIntegral) can be passed in to share it between standards.
+    Returns None if the data does not cover the standard's wavelength range.
+    '''
+    percents = _binPercents(standard, waves, irrad, cumIrrad)
+    if percents is None:
+        return None
+    classLetters = gradeBins(percents, standard['ratios']).tolist()
+
+    theDictionary = {
+        'percents': percents,
+        'classLetters': classLetters,
+        'classification': worstGrade(classLetters),
+    }
+    return theDictionary
+
+
+def referenceLoad(path = REFERENCE_PATH):
+    '''
+    referenceLoad returns the ASTM G173-03 reference spectra as a dictionary of read-only NumPy arrays keyed by REFERENCE_NAMES.
+    Irradiance columns are in W/m^2/nm. The file is parsed once per process by the ReferenceData store.
+    '''
+    return referenceTable(path, REFERENCE_NAMES, header = 0)
+
+
+def sidatSpectrum(fullData):
+    '''
+    sidatSpectrum returns the wavelength and spectral irradiance arrays of a sidatImport result.
+    The last five rows of the scan are dropped, as SMScript2 has always done.
+    '''
+    waves = np.asarray(fullData['wavelengths'], dtype = np.float64)[:-5]
+    irrad = np.asarray(fullData['irradiance'], dtype = np.float64)[:-5]
+    return waves, irrad
+
+
+def classifyAll(fullData, AMTypes = None):
+    '''
+    classifyAll grades one sidatImport result against every standard in the registry (or only the AMTypes given) in a single pass.
+    The measurement is integrated once on its native samples, and SPD/SPC are computed once per reference spectrum, then shared by all standards.
+    Returns {AMType: result}, where result holds 'name', 'AM', 'binLabels', 'percents', 'classLetters', 'classification', 'SPD', 'SPC'
+    and the per-band 'bandSPD'/'bandSPC' contributions over the IEC Table 2 bands (see spdSpc),
+    or is None if the data does not cover that standard's wavelength range.
+    '''
+    standards = standardsLoad()
+    if AMTypes is None:
+        AMTypes = list(standards)
+    specRef = referenceLoad()
+    waves, irrad = sidatSpectrum(fullData)
+
+    # Integrate the collected data once on its native wavelength samples for all standards.
+    cumIrrad = cumulativeIntegral(waves, irrad)
+
+    # SPD and SPC only depend on the reference spectrum, so they are shared by the standards that use it.
+    deviations = {}
+    results = {}
+    for AMType in AMTypes:
+        standard = standards[AMType]
+        binResult = binClassify(standard, waves, irrad, cumIrrad)
+        if binResult is None:
+            results[AMType] = None
+            continue
+
+        reference = standard['reference']
+        if reference not in deviations:
+            deviations[reference] = spdSpc(waves, irrad, specRef['Wavelengths'], specRef[reference] / 10000)
+
+        results[AMType] = {
+            'name': standard['name'],
+            'AM': standard['AM'],
+            'binLabels': standard['binLabels'],
+            'percents': binResult['percents'],
+            'classLetters': binResult['classLetters'],
+            'classification': binResult['classification'],
+            'SPD': deviations[reference]['SPD'],
+            'SPC': deviations[reference]['SPC'],
+            'bandSPD': deviations[reference]['bandSPD'],
+            'bandSPC': deviations[reference]['bandSPC'],
+        }
+    return results
+
+
+def classifyAllFrame(results):
+    '''
+    classifyAllFrame lays out a classifyAll result as a table with one row per standard, for side-by-side display.
+    '''
+    rows = {}
+    for result in results.values():
+        if result is None:
+            continue
+        rows[result['name']] = {
+            'Classification': result['classification'],
+            'SPD Absolute Error [%]': round(result['SPD'], 4),
+            'Aggregate SPC [%]': round(result['SPC'], 4),
+            'Interval Ratios [%]': ', '.join('%s: %.2f (%s)' % binRow for binRow in zip(result['binLabels'], result['percents'], result['classLetters'])),
+        }
+    return pd.DataFrame.from_dict(rows, orient = 'index')
+
+
+def spectraStack(spectra, waves):
+    '''
+    spectraStack resamples a list of (wavelengths, irradiance) pairs onto the common wavelength grid `waves`
+    and returns them as an (N, len(waves)) array ready for classifyBatch.
+    '''
+    waves = np.asarray(waves, dtype = np.float64)
+    stack = np.empty((len(spectra), len(waves)))
+    for row, (specWaves, specIrrad) in enumerate(spectra):
+        stack[row] = np.interp(waves, specWaves, specIrrad)
+    return stack
+
+
+def classifyBatch(waves, spectra, AMTypes = None, labels = None, chunkSize = 512):
+    '''
+    classifyBatch grades an (N, wavelengths) stack of spectra, all sampled on the grid `waves`, against every standard (or only the AMTypes given).
+    It only does array arithmetic, so no figures or files are produced; spectra are processed chunkSize at a time to bound memory.
+    Returns {AMType: table}, where table is a DataFrame with one row per spectrum (indexed by labels, if given) holding the classification,
+    SPD, SPC and each bin's ratio and grade, or None if `waves` does not cover that standard's wavelength range.
+    '''
+    waves = np.asarray(waves, dtype = np.float64)
+    spectra = np.atleast_2d(np.asarray(spectra, dtype = np.float64))
+    standards = standardsLoad()
+    if AMTypes is None:
+        AMTypes = list(standards)
+    specRef = referenceLoad()
+
+    # Work out which standards the grid covers once, up front, so uncovered ones are only reported once.
+    covered = [AMType for AMType in AMTypes if _binPercents(standards[AMType], waves, spectra[:1]) is not None]
+    percents = {AMType: [] for AMType in covered}
+    deviations = {}
+    for start in range(0, len(spectra), chunkSize):
+        chunk = spectra[start:start + chunkSize]
+        cumIrrad = cumulativeIntegral(waves, chunk)
+        chunkDeviations = {}
+        for AMType in covered:
+            standard = standards[AMType]
+            percents[AMType].append(_binPercents(standard, waves, chunk, cumIrrad))
+            reference = standard['reference']
+            if reference not in chunkDeviations:
+                chunkDeviations[reference] = spdSpc(waves, chunk, specRef['Wavelengths'], specRef[reference] / 10000)
+                deviations.setdefault(reference, []).append(chunkDeviations[reference])
+
+    results = {}
+    for AMType in AMTypes:
+        if AMType not in covered:
+            results[AMType] = None
+            continue
+        standard = standards[AMType]
+        binPercents = np.concatenate(percents[AMType])
+        ranks = _gradeRanks(binPercents, standard['ratios'])
+        grades = np.array(GRADE_ORDER)[ranks]
+        deviation = deviations[standard['reference']]
+
+        table = {
+            'Classification': np.array(GRADE_ORDER)[ranks.max(axis = 1)],
+            'SPD Absolute Error [%]': np.concatenate([chunkResult['SPD'] for chunkResult in deviation]),
+            'Aggregate SPC [%]': np.concatenate([chunkResult['SPC'] for chunkResult in deviation]),
+        }
+        for binIndex, binLabel in enumerate(standard['binLabels']):
+            table[binLabel + ' [%]'] = binPercents[:, binIndex]
+            table[binLabel + ' Class'] = grades[:, binIndex]
+        results[AMType] = pd.DataFrame(table, index = labels)
+    return results
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Temporal instability (TI, STI, LTI) of irradiance logs as defined in IEC 60904-9, computed with whole-array NumPy operations.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from .SciImports import sciFileParse, fileContents
+
+TIME_BTW_POINTS = 0.19      # default time in seconds between logged points
+LINE_FREQUENCY = 60         # mains frequency in Hz; one sample integrates one power line cycle (NPLC = 1 per sample)
+POINT_OVERHEAD = TIME_BTW_POINTS - 1 / LINE_FREQUENCY      # source meter overhead per point, so 1 sample, no wait/dwell gives 0.19 s
+FLICKER_BANDS = (0, 0.1, 1, 10, 40, 70, 130, np.inf)        # Hz; drift, arc wander, flicker, 50/60 Hz ripple, 100/120 Hz ripple
+MIN_POINTS = 20             # datasets with fewer points are rejected
+TI_COLUMNS = ['Upload Name', 'Filename', 'Date of Measurement', 'Detector Area', 'Time Between Data Points [s]', 'Total Measurement Points', 'Maximum Irradiance [Suns]',
+              'Minimum Irradiance [Suns]', 'Short Term Instability [%]', 'Temporal Instability [%]', 'Long Term Instability [%]', 'Status']
+
+
+def pointTiming(spp, wait, dwell, lineFrequency = LINE_FREQUENCY):
+    '''
+    pointTiming works out the number of power line cycles per point and the time between points of a TI log from its
+    NumberOfSamplesPerPoint (spp), WaitSeconds and DwellSeconds header fields (numbers or the strings read from the header).
+    Each sample integrates one power line cycle, so NPLC = spp, and a point takes wait + dwell + NPLC / lineFrequency plus the instrument overhead.
+    Missing or unreadable fields fall back to 1 sample and no wait/dwell, which gives the standard TIME_BTW_POINTS.
+    Returns a dictionary with 'NPLC' and 'timeStep' [s].
+    '''
+    def number(value, default):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return default
+        return default if np.isnan(value) else value
+
+    NPLC = number(spp, 1.0)
+    theDictionary = {
+        'NPLC': NPLC,
+        'timeStep': number(wait, 0.0) + number(dwell, 0.0) + NPLC / lineFrequency + POINT_OVERHEAD,
+    }
+    return theDictionary
+
+
+def instability(high, low):
+    '''
+    instability returns 100 * |(high - low) / (high + low)|, the IEC 60904-9 instability in % for a max/min pair (or arrays of them).
+    '''
+    return 100 * np.abs((high - low) / (high + low))
+
+
+def rollingExtrema(values, windowPoints):
+    '''
+    rollingExtrema returns the (max, min) of every run of windowPoints consecutive values, one entry per window start.
+    The running filters cost O(N) regardless of the window length, so hour-long logs with long windows stay cheap.
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    # The filters are centred; shift the origin so entry i covers values[i:i + windowPoints].
+    origin = -(windowPoints // 2)
+    count = len(values) - windowPoints + 1
+    high = maximum_filter1d(values, windowPoints, origin = origin)[:count]
+    low = minimum_filter1d(values, windowPoints, origin = origin)[:count]
+    return high, low
+
+
+def tiStats(current, timeStep = TIME_BTW_POINTS, ltiWindow = None):
+    '''
+    tiStats calculates the temporal instability figures of one irradiance (detector current) log.
+        TI  = instability over the whole log
+        STI = worst instability between consecutive points
+        LTI = worst instability over any ltiWindow seconds of the log (only when ltiWindow is given)
+    The mean reading is taken to be 1 Sun, and the min/max irradiance are reported relative to it.
+    Returns a dictionary of the figures, including where in the log (in seconds) the worst STI and LTI occur.
+    '''
+    current = np.asarray(current, dtype = np.float64)
+    high = current.max()
+    low = current.min()
+    sun = current.mean()
+
+    # Short term: every consecutive pair at once.
+    sti = instability(current[1:], current[:-1])
+    stiIndex = int(np.argmax(sti))
+
+    theDictionary = {
+        'TI': instability(high, low),
+        'STI': sti[stiIndex],
+        'STI Time': (stiIndex + 1) * timeStep,
+        'sun': sun,
+        'maxIrrad': high / sun,
+        'minIrrad': low / sun,
+        'numPoints': len(current),
+        'LTI': None,
+        'LTI Start': None,
+        'LTI Window': ltiWindow,
+    }
+
+    if ltiWindow is not None:
+        windowPoints = int(round(ltiWindow / timeStep)) + 1
+        if windowPoints > len(current):
+            print('The LTI window of ' + str(ltiWindow) + ' s is longer than the log (' + str((len(current) - 1) * timeStep) + ' s). No LTI was calculated.')
+        else:
+            lti = instability(*rollingExtrema(current, windowPoints))
+            ltiIndex = int(np.argmax(lti))
+            theDictionary['LTI'] = lti[ltiIndex]
+            theDictionary['LTI Start'] = ltiIndex * timeStep
+
+    return theDictionary
+
+
+def flickerSpectrum(current, timeStep, segmentLength = 4096, chunkSegments = 64, bands = FLICKER_BANDS, peaks = 5):
+    '''
+    flickerSpectrum calculates the power spectrum of the relative fluctuation of a current trace (Welch's method: Hann-windowed,
+    50% overlapping segments of segmentLength points, each with its own mean removed) to separate mains ripple from slow arc wander.
+    The segments are transformed chunkSegments at a time with rfft, so the working memory is fixed however long the trace is;
+    current can be a memory-mapped array. Traces shorter than segmentLength are analyzed as a single segment.
+    Returns a dictionary with
+        'frequencies' [Hz] and 'psd' [1/Hz] (power spectral density of current / mean current)
+        'dominant'    the `peaks` strongest spectral peaks as (frequency [Hz], RMS amplitude [%]) pairs
+        'bands'       {'low-high Hz': RMS fluctuation [%] in that band} for the bands below the Nyquist frequency
+    '''
+    current = np.asarray(current)
+    count = len(current)
+    segmentLength = int(min(segmentLength, count))
+    hop = max(segmentLength // 2, 1)
+    starts = np.arange(0, count - segmentLength + 1, hop)
+    window = np.hanning(segmentLength) if segmentLength > 1 else np.ones(1)
+    sampleRate = 1 / timeStep
+    mean = np.mean(current, dtype = np.float64)
+
+    power = np.zeros(segmentLength // 2 + 1)
+    for first in range(0, len(starts), chunkSegments):
+        # (segments, segmentLength) block of this chunk, in relative units.
+        block = current[starts[first:first + chunkSegments, None] + np.arange(segmentLength)] / mean
+        block -= block.mean(axis = 1, keepdims = True)
+        power += (np.abs(np.fft.rfft(block * window, axis = 1)) ** 2).sum(axis = 0)
+
+    # One-sided PSD scaled so that its integral is the variance of the fluctuation.
+    psd = power / (len(starts) * sampleRate * (window ** 2).sum())
+    psd[1:-1 if segmentLength % 2 == 0 else None] *= 2
+    frequencies = np.fft.rfftfreq(segmentLength, timeStep)
+    step = frequencies[1] if len(frequencies) > 1 else sampleRate
+
+    # Spectral peaks: local maxima above DC, strongest first.
+    interior = np.nonzero((psd[1:-1] > psd[:-2]) & (psd[1:-1] >= psd[2:]))[0] + 1
+    strongest = interior[np.argsort(psd[interior])[::-1][:peaks]]
+    # Peak power is summed over the Hann main lobe (three bins) to recover the RMS amplitude of a tone.
+    lobe = psd[np.clip(strongest[:, None] + np.arange(-1, 2), 0, len(psd) - 1)].sum(axis = 1) * step
+
+    nyquist = sampleRate / 2
+    cumulative = np.concatenate(([0.0], np.cumsum(psd[1:]) * step))
+    edges = np.asarray(bands, dtype = np.float64)
+    bandPower = {}
+    for low, high in zip(edges[:-1], edges[1:]):
+        if low >= nyquist:
+            break
+        label = ('%g-%g Hz' % (low, high)) if np.isfinite(high) else ('>%g Hz' % low)
+        # Bins with low < f <= high (DC excluded), from the running sum.
+        lowIndex = np.searchsorted(frequencies[1:], low, side = 'right')
+        highIndex = np.searchsorted(frequencies[1:], high, side = 'right')
+        bandPower[label] = 100 * np.sqrt(cumulative[highIndex] - cumulative[lowIndex])
+
+    theDictionary = {
+        'frequencies': frequencies,
+        'psd': psd,
+        'dominant': list(zip(frequencies[strongest].tolist(), (100 * np.sqrt(lobe)).tolist())),
+        'bands': bandPower,
+        'sampleRate': sampleRate,
+        'segments': len(starts),
+    }
+    return theDictionary
+
+
+def _tiRow(name, filename, date, detArea, current, timeStep, ltiWindow):
+    '''
+    Returns the TI table row of one log from its current readings and header values.
+    '''
+    result = tiStats(current, timeStep, ltiWindow)
+    row = {
+        'Upload Name': name,
+        'Filename': filename,
+        'Date of Measurement': date,
+        'Detector Area': detArea,
+        'Time Between Data Points [s]': timeStep,
+        'Total Measurement Points': result['numPoints'],
+        'Maximum Irradiance [Suns]': result['maxIrrad'],
+        'Minimum Irradiance [Suns]': result['minIrrad'],
+        'Short Term Instability [%]': result['STI'],
+        'Temporal Instability [%]': result['TI'],
+        'Long Term Instability [%]': result['LTI'],
+        'Status': 'OK',
+    }
+    return row
+
+
+def _tiFile(item):
+    '''
+    Batch worker: parses one .ivdat file's contents and returns its row of the TI table.
+    Any problem with the file is returned as the row's 'Status' instead of being raised, so one bad file cannot stop a batch.
+    '''
+    name, content, timeStep, ltiWindow, minPoints = item
+    try:
+        parsed = sciFileParse(content)
+        currentName = [column for column in parsed['columns'] if 'current' in column.lower()]
+        if not currentName:
+            raise ValueError('no current column (found ' + ', '.join(parsed['columns']) + ')')
+        current = parsed['data'][currentName[0]]
+        if len(current) < minPoints:
+            raise ValueError('insufficient (<' + str(minPoints) + ') data points')
+        header = parsed['header']
+        if timeStep is None:
+            timeStep = pointTiming(header.get('NumberOfSamplesPerPoint'), header.get('WaitSeconds'), header.get('DwellSeconds'))['timeStep']
+        return _tiRow(name, header.get('FileName', name), header.get('Date'), header.get('DUTArea'), current, timeStep, ltiWindow)
+    except Exception as error:
+        return {'Upload Name': name, 'Status': str(error)}
+
+
+def _tiRanked(rows, topK):
+    '''
+    Ranks TI table rows from worst to best TI and separates the rows that could not be analyzed. Returns the tiBatch dictionary.
+    '''
+    frame = pd.DataFrame(rows, columns = TI_COLUMNS)
+    good = frame['Status'] == 'OK'
+    skipped = frame.loc[~good, ['Upload Name', 'Status']].reset_index(drop = True)
+    for _, bad in skipped.iterrows():
+        print('The following datafile could not be analyzed and will be ignored: ' + bad['Upload Name'] + ' (' + bad['Status'] + ')')
+
+    table = frame.loc[good].drop(columns = 'Status').sort_values('Temporal Instability [%]', ascending = False, kind = 'stable')
+    table = table.reset_index(drop = True)
+    table.index += 1    # rank, 1 = worst
+
+    theDictionary = {
+        'table': table,
+        'worst': table.head(topK),
+        'skipped': skipped,
+    }
+    return theDictionary
+
+
+def tiBatch(files, topK = 5, timeStep = None, ltiWindow = None, minPoints = MIN_POINTS, processes = None):
+    '''
+    tiBatch analyzes the temporal instability of many .ivdat files at once and ranks them from worst to best TI.
+    files can be uploaded file objects (anything with .name and .getvalue() or .read()) or paths.
+    timeStep = None takes each file's time between points from its header (see pointTiming).
+    The files are read here and parsed and analyzed across a process pool of `processes` workers (default: one per CPU);
+    small batches, or processes = 1, run in this process since starting the pool would cost more than it saves.
+    Files whose data is already imported (e.g. in the Streamlit app) should go through tiTable instead, which needs no parsing or pool.
+    Files that cannot be read or analyzed are left out of the ranking and listed with the reason in 'skipped'.
+    Returns a dictionary with the ranked 'table' (a DataFrame, worst file first), its top-k rows as 'worst', and 'skipped'.
+    '''
+    items = [(name, content, timeStep, ltiWindow, minPoints) for name, content in fileContents(files)]
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(items))
+    if processes <= 1 or len(items) < 8:
+        rows = [_tiFile(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            rows = list(pool.map(_tiFile, items, chunksize = max(1, len(items) // (4 * processes))))
+
+    return _tiRanked(rows, topK)
+
+
+def tiTable(tiData, topK = 5, timeStep = None, ltiWindow = None, minPoints = MIN_POINTS):
+    '''
+    tiTable ranks datasets that are already imported (the ivdatImports dictionary, as passed to TIScript) from worst to best TI,
+    without reading or parsing the files again. The options and the returned dictionary are those of tiBatch.
+    '''
+    rows = []
+    for key, dataset in tiData.items():
+        name = str(dataset.get('filename', key))
+        try:
+            current = np.asarray(dataset['current'], dtype = np.float64)
+            if len(current) < minPoints:
+                raise ValueError('insufficient (<' + str(minPoints) + ') data points')
+            step = timeStep if timeStep is not None else pointTiming(dataset.get('spp'), dataset.get('wait'), dataset.get('dwell'))['timeStep']
+            rows.append(_tiRow(name, name, dataset.get('date'), dataset.get('detArea'), current, step, ltiWindow))
+        except Exception as error:
+            rows.append({'Upload Name': name, 'Status': str(error)})
+    return _tiRanked(rows, topK)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Live temporal instability monitoring of .ivdat logs that are still being written (e.g. during lamp burn-in).
+The running state is a small dictionary of fixed size, so a log of any length is followed in constant memory.
+"""
+import os
+import glob
+import time
+from collections import deque
+import numpy as np
+from .TIAnalysis import instability, pointTiming
+
+
+def monitorState(stiPoints = 20, timeStep = None):
+    '''
+    monitorState returns an empty running state for monitorUpdate.
+    stiPoints is the length (in points) of the recent-readings window whose instability is reported as 'Window Instability [%]'.
+    timeStep is the time between points [s]; None leaves it to be set from the log header (ivdatMonitor does this),
+    and until then the standard timing of pointTiming is used.
+    '''
+    theDictionary = {
+        'count': 0,
+        'mean': 0.0,
+        'm2': 0.0,                              # Welford sum of squared deviations from the mean
+        'max': -np.inf,
+        'min': np.inf,
+        'STI': 0.0,
+        'last': None,                           # previous reading, for the consecutive-point STI
+        'window': deque(maxlen = stiPoints),
+        'timeStep': timeStep,
+    }
+    return theDictionary
+
+
+def monitorUpdate(state, current):
+    '''
+    monitorUpdate folds a batch of new current readings into a running state and returns the updated report (see monitorReport).
+    The batch mean and variance are merged into the running values with the parallel form of Welford's algorithm,
+    so the result matches a full recalculation without ever holding the earlier readings.
+    '''
+    current = np.asarray(current, dtype = np.float64).reshape(-1)
+    if len(current) == 0:
+        return monitorReport(state)
+
+    count = state['count'] + len(current)
+    batchMean = current.mean()
+    delta = batchMean - state['mean']
+    state['m2'] += ((current - batchMean) ** 2).sum() + delta ** 2 * state['count'] * len(current) / count
+    state['mean'] += delta * len(current) / count
+    state['count'] = count
+    state['max'] = max(state['max'], current.max())
+    state['min'] = min(state['min'], current.min())
+
+    # Consecutive pairs, including the pair across the previous batch boundary.
+    pairs = current if state['last'] is None else np.concatenate(([state['last']], current))
+    if len(pairs) > 1:
+        state['STI'] = max(state['STI'], instability(pairs[1:], pairs[:-1]).max())
+    state['last'] = current[-1]
+    state['window'].extend(current[-state['window'].maxlen:])
+
+    return monitorReport(state)
+
+
+def monitorReport(state):
+    '''
+    monitorReport summarizes a running state in a dictionary keyed 'Temporal Instability [%]' and 'Short Term Instability [%]' (so far),
+    'Window Instability [%]' (the last stiPoints readings), 'Mean Current [A]', 'Standard Deviation [A]', 'Maximum Irradiance [Suns]'
+    and 'Minimum Irradiance [Suns]' (relative to the mean), 'Total Measurement Points' and 'Elapsed Time [s]'.
+    The figures are None until the first reading has arrived.
+    '''
+    count = state['count']
+    timeStep = state['timeStep'] if state['timeStep'] is not None else pointTiming(None, None, None)['timeStep']
+    theDictionary = {
+        'Total Measurement Points': count,
+        'Elapsed Time [s]': max(count - 1, 0) * timeStep,
+        'Temporal Instability [%]': None,
+        'Short Term Instability [%]': None,
+        'Window Instability [%]': None,
+        'Mean Current [A]': None,
+        'Standard Deviation [A]': None,
+        'Maximum Irradiance [Suns]': None,
+        'Minimum Irradiance [Suns]': None,
+    }
+    if count == 0:
+        return theDictionary
+
+    window = np.fromiter(state['window'], dtype = np.float64)
+    theDictionary['Temporal Instability [%]'] = instability(state['max'], state['min'])
+    theDictionary['Short Term Instability [%]'] = state['STI']
+    theDictionary['Window Instability [%]'] = instability(window.max(), window.min())
+    theDictionary['Mean Current [A]'] = state['mean']
+    theDictionary['Standard Deviation [A]'] = np.sqrt(state['m2'] / (count - 1)) if count > 1 else 0.0
+    theDictionary['Maximum Irradiance [Suns]'] = state['max'] / state['mean']
+    theDictionary['Minimum Irradiance [Suns]'] = state['min'] / state['mean']
+    return theDictionary
+
+
+def _tailOpen(path):
+    '''
+    Returns a fresh reader for one .ivdat file: the open file, the unparsed partial line, the header fields and where we are in the file layout.
+    '''
+    return {
+        'path': path,
+        'file': open(path, 'r', encoding = 'utf-8', errors = 'replace', newline = ''),
+        'partial': '',
+        'header': {},           # header fields (e.g. NumberOfSamplesPerPoint) read so far, as strings
+        'column': None,         # index of the current column, known once the column-name line has been read
+        'done': False,          # True once END DATA has been read
+        'skipped': False,       # True if the file cannot be monitored (e.g. no current column)
+    }
+
+
+def _tailRead(reader):
+    '''
+    Reads whatever has been appended to the file since the last call and returns the new current readings as an array.
+    Only complete lines are parsed; a line still being written is kept for the next call. The "Key:\t"value"" lines before the
+    column names are collected in reader['header'].
+    '''
+    text = reader['partial'] + reader['file'].read()
+    lines = text.replace('\r\n', '\n').split('\n')
+    reader['partial'] = lines.pop()
+    values = []
+    for line in lines:
+        line = line.strip()
+        if reader['done'] or not line:
+            continue
+        if reader['column'] is None:
+            if line.startswith('Voltage'):
+                names = [name.strip().lower() for name in line.split('\t')]
+                columns = [index for index, name in enumerate(names) if 'current' in name]
+                if not columns:
+                    print('The following datafile has no current column and will be ignored: ' + os.path.basename(reader['path'])
+                          + ' (found ' + ', '.join(names) + ')')
+                    reader['done'] = True
+                    reader['skipped'] = True
+                    break
+                reader['column'] = columns[0]
+            elif ':' in line:
+                key, value = line.split(':', 1)
+                reader['header'][key.strip()] = value.strip().strip('"')
+            continue
+        if line.startswith('END DATA'):
+            reader['done'] = True
+            continue
+        try:
+            values.append(float(line.split('\t')[reader['column']]))
+        except (ValueError, IndexError):
+            print('Skipping unreadable row in ' + os.path.basename(reader['path']) + ': ' + line)
+    return np.array(values, dtype = np.float64)
+
+
+def _newestLog(folder, ignore = ()):
+    '''
+    Returns the most recently modified .ivdat file in a folder, leaving out the paths in `ignore`, or None if there is none.
+    '''
+    logs = [log for log in glob.glob(os.path.join(folder, '*.ivdat')) if log not in ignore]
+    return max(logs, key = os.path.getmtime) if logs else None
+
+
+def ivdatMonitor(path, callback = None, stiPoints = 20, timeStep = None, pollInterval = 1.0, idleTimeout = None):
+    '''
+    ivdatMonitor follows a growing .ivdat log and reports its temporal instability as rows arrive.
+    path is a single .ivdat file, or a folder in which case the newest .ivdat is followed and the monitor moves on whenever a newer log appears.
+    After every poll that brings new rows, callback(filename, report) is called with the report from monitorUpdate;
+    a Streamlit dashboard can pass e.g. lambda name, report: placeholder.table(report) for a live view.
+    timeStep is the time between points [s]; None works it out for each log from its NumberOfSamplesPerPoint, WaitSeconds
+    and DwellSeconds header fields with pointTiming.
+    A log without a current column is reported and ignored; in folder mode the monitor moves on to the newest remaining log.
+    A single file is followed until its END DATA line; a folder until no new rows have arrived for idleTimeout seconds
+    (idleTimeout also stops a single file that stops growing). idleTimeout = None waits indefinitely.
+    Returns a dictionary of the final report for every log that was followed, keyed by file name.
+    '''
+    folderMode = os.path.isdir(path)
+    reports = {}
+    skipped = set()
+    reader = None
+    state = None
+    lastData = time.monotonic()
+
+    try:
+        while True:
+            if folderMode:
+                newest = _newestLog(path, skipped)
+                if newest is not None and (reader is None or newest != reader['path']):
+                    if reader is not None:
+                        reader['file'].close()
+                    reader = _tailOpen(newest)
+                    state = monitorState(stiPoints, timeStep)
+                    print('Monitoring ' + os.path.basename(newest))
+            elif reader is None:
+                reader = _tailOpen(path)
+                state = monitorState(stiPoints, timeStep)
+
+            if reader is not None:
+                values = _tailRead(reader)
+                if state['timeStep'] is None and reader['column'] is not None:
+                    header = reader['header']
+                    state['timeStep'] = pointTiming(header.get('NumberOfSamplesPerPoint'), header.get('WaitSeconds'), header.get('DwellSeconds'))['timeStep']
+                if len(values):
+                    lastData = time.monotonic()
+                    report = monitorUpdate(state, values)
+                    reports[os.path.basename(reader['path'])] = report
+                    if callback is not None:
+                        callback(os.path.basename(reader['path']), report)
+                if reader['skipped']:
+                    skipped.add(reader['path'])
+                    reader['file'].close()
+                    reader = None
+                    if not folderMode:
+                        break
+                elif reader['done'] and not folderMode:
+                    break
+
+            if idleTimeout is not None and time.monotonic() - lastData > idleTimeout:
+                print('No new data for ' + str(idleTimeout) + ' s. Monitoring stopped.')
+                break
+            time.sleep(pollInterval)
+    finally:
+        if reader is not None:
+            reader['file'].close()
+
+    return reports
@@ -243,6 +243,17 @@ if uploaded_TI:
     #     st.write(value)
 
     st.write("Results:", TI_report)
+
+    # Frequency content of the worst dataset (mains ripple vs. slow drift).
+    worst_dataset = [value for value in result_TI.values() if value['filename'] == worst_filename][0]
+    st.write("Flicker:", FlickerScript(worst_dataset))
+
+    # Rank every uploaded file, worst first. Files that could not be analyzed are listed separately.
+    TI_batch = tiTable(result_TI)
+    st.write("All files (worst first):", TI_batch['table'])
+    if len(TI_batch['skipped']):
+        st.warning("Some files could not be analyzed:")
+        st.write(TI_batch['skipped'])
 else:
     st.error("TI file not uploaded")
 
@@ -288,6 +299,9 @@ if uploaded_full:
     SM_report = SMScript2(AMType, result, label)
     st.write("Results:", SM_report)
 
+    # Classify the same spectrum against every standard for side-by-side comparison
+    st.write("All standards:", classifyAllFrame(classifyAll(result)))
+
     df = SM_report['df']
     csv_data_SM = df.to_csv(index=False).encode('utf-8')
 else: